@@ -0,0 +1,122 @@
+"""
+Coalesced room broadcasts.
+
+Instead of one group_send per incoming message, events for a group are held
+for ``BROADCAST["TICK"]`` seconds and sent as a single group message. Within
+a tick a newer full-state event (a whole page, outline or member list)
+replaces the pending one of the same type, and consecutive edit deltas from
+the same author, outline patches, or streamed tokens for the same page are
+merged.
+"""
+import asyncio
+import threading
+from django.conf import settings
+
+# Events that carry the room's whole state; only the latest one matters
+FULL_STATE = {"document_update", "outline_update", "presence_update"}
+
+
+def merge(pending, event):
+    """Folds `event` into the last pending event when possible, returning True if it did."""
+    last = pending[-1] if pending else None
+    if not last or last["type"] != event["type"] or last.get("meta") != event.get("meta"):
+        return False
+
+    if event["type"] == "document_delta":
+        last["data"] = {"ops": last["data"]["ops"] + event["data"]["ops"], "version": event["data"]["version"]}
+        return True
+
+    if event["type"] == "outline_patch" and last["status"] == event["status"]:
+        last["patch"] = last["patch"] + event["patch"]
+        return True
+
+    if event["type"] == "document_stream" and last["status"] == event["status"] == "generating":
+        last["data"] = {"delta": last["data"]["delta"] + event["data"]["delta"]}
+        return True
+
+    return False
+
+
+class BroadcastCoalescer:
+    def __init__(self):
+        self.pending = {}  # group -> events waiting for the tick
+        self.lock = threading.Lock()
+        self.received = 0
+        self.sent = 0
+        self.superseded = 0
+        self.merged = 0
+
+    async def send(self, channel_layer, group, event):
+        tick = settings.BROADCAST["TICK"]
+
+        with self.lock:
+            self.received += 1
+
+        if not tick:
+            await self.group_send(channel_layer, group, [event])
+            return
+
+        with self.lock:
+            first = group not in self.pending
+            pending = self.pending.setdefault(group, [])
+
+            if event["type"] in FULL_STATE:
+                stale = [queued for queued in pending if queued["type"] == event["type"]]
+                for queued in stale:
+                    pending.remove(queued)
+                self.superseded += len(stale)
+
+            if merge(pending, event):
+                self.merged += 1
+            else:
+                pending.append(dict(event))
+
+        if first:
+            asyncio.ensure_future(self.flush_later(channel_layer, group, tick))
+
+    async def flush_later(self, channel_layer, group, tick):
+        await asyncio.sleep(tick)
+
+        with self.lock:
+            events = self.pending.pop(group, [])
+
+        try:
+            if events:
+                await self.group_send(channel_layer, group, events)
+        except Exception as e:
+            print(f"Broadcast to {group} failed: {e}")
+
+    async def group_send(self, channel_layer, group, events):
+        with self.lock:
+            self.sent += 1
+
+        if len(events) == 1:
+            await channel_layer.group_send(group, events[0])
+        else:
+            await channel_layer.group_send(group, {"type": "broadcast_batch", "events": events})
+
+    def stats(self):
+        with self.lock:
+            return {
+                "tick_ms": settings.BROADCAST["TICK"] * 1000,
+                "received": self.received,
+                "sent": self.sent,
+                "superseded": self.superseded,
+                "merged": self.merged,
+                # events in per group message sent; 1.0 means nothing was coalesced
+                "coalescing_ratio": self.received / self.sent if self.sent else 1.0,
+            }
+
+
+coalescer = BroadcastCoalescer()
+
+
+class BroadcastMixin:
+    """Room broadcasts for a consumer with a `room_group_name`."""
+
+    async def broadcast(self, event):
+        await coalescer.send(self.channel_layer, self.room_group_name, event)
+
+    async def broadcast_batch(self, event):
+        for message in event["events"]:
+            await self.dispatch(message)
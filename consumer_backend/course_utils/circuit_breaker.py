@@ -0,0 +1,197 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+
+
+class ScriboBusyError(Exception):
+    """Raised instead of waiting when the model server is failing or saturated."""
+
+
+class BreakerStates:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls
+    for `reset_timeout` seconds, then lets a single trial call through
+    (half-open). The trial's outcome closes or re-opens the circuit.
+
+    before_call returns a token for record. Only the trial's token decides
+    a half-open circuit, and calls started before the circuit last opened
+    count for nothing, so a late result from before the outage cannot
+    close it.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = BreakerStates.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.epoch = 0  # bumped each time the circuit opens
+        self.trial = None
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        """Admits a call or raises ScriboBusyError. Returns the token for record."""
+        with self.lock:
+            if self.state == BreakerStates.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    raise ScriboBusyError("The model server is unavailable, try again shortly.")
+                self.state = BreakerStates.HALF_OPEN
+
+            if self.state == BreakerStates.HALF_OPEN:
+                if self.trial is not None:
+                    raise ScriboBusyError("The model server is recovering, try again shortly.")
+                self.trial = object()
+                return self.trial
+
+            return self.epoch
+
+    def record(self, token, ok):
+        """Counts a finished call; `ok` of None (cancelled) counts for nothing."""
+        with self.lock:
+            if self.trial is not None and token is self.trial:
+                # a cancelled trial leaves the circuit half-open for the next call
+                self.trial = None
+                if ok is None:
+                    return
+
+                if ok:
+                    self.state = BreakerStates.CLOSED
+                    self.failures = 0
+                else:
+                    self.open()
+                return
+
+            if ok is None or token != self.epoch or self.state != BreakerStates.CLOSED:
+                return
+
+            if ok:
+                self.failures = 0
+                return
+
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.open()
+
+    def open(self):
+        self.state = BreakerStates.OPEN
+        self.opened_at = time.monotonic()
+        self.epoch += 1
+
+    def snapshot(self):
+        with self.lock:
+            retry_in = None
+            if self.state == BreakerStates.OPEN:
+                retry_in = max(0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "retry_in": retry_in,
+            }
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit: every good call raises the limit by 1/limit
+    (about one slot per round of calls); a failed or slow call halves it.
+    Calls over the limit are rejected rather than queued.
+    """
+
+    def __init__(self, min_limit, max_limit, backoff=0.5):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.in_flight >= int(self.limit):
+                self.rejected += 1
+                raise ScriboBusyError("The model server is busy, try again shortly.")
+            self.in_flight += 1
+
+    def release(self, ok=None):
+        """Frees a slot; `ok` of None leaves the limit untouched."""
+        with self.lock:
+            self.in_flight -= 1
+
+            if ok is True:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            elif ok is False:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "rejected": self.rejected,
+            }
+
+
+class CallOutcome:
+    """Lets the caller mark a completed request as a failure, e.g. on a 5xx."""
+
+    def __init__(self):
+        self.failed = False
+
+
+breaker = CircuitBreaker(
+    failure_threshold=settings.SCRIBO["BREAKER_FAILURE_THRESHOLD"],
+    reset_timeout=settings.SCRIBO["BREAKER_RESET_TIMEOUT"],
+)
+
+limiter = AdaptiveLimiter(
+    min_limit=settings.SCRIBO["MIN_CONCURRENT_REQUESTS"],
+    max_limit=settings.SCRIBO["MAX_CONCURRENT_REQUESTS"],
+)
+
+
+@contextmanager
+def guard(slow_after=None):
+    """
+    Wraps one model server call in the limiter and the breaker. Raises
+    ScriboBusyError up front when either rejects it. Exceptions from the
+    call, a marked failure, or taking longer than `slow_after` seconds
+    count against the server; a cancelled call counts for nothing.
+    """
+    limiter.acquire()
+
+    try:
+        token = breaker.before_call()
+    except ScriboBusyError:
+        limiter.release()
+        raise
+
+    outcome = CallOutcome()
+    started = time.monotonic()
+    ok = False
+
+    try:
+        yield outcome
+        ok = not outcome.failed
+    except (asyncio.CancelledError, GeneratorExit):
+        ok = None
+        raise
+    finally:
+        if ok is None:
+            limiter.release()
+        else:
+            slow = slow_after is not None and time.monotonic() - started > slow_after
+            limiter.release(ok and not slow)
+        breaker.record(token, ok)
+
+
+def status():
+    return {"breaker": breaker.snapshot(), "limiter": limiter.snapshot()}
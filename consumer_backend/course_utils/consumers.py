@@ -1,39 +1,142 @@
+import asyncio
 import json
-from channels.generic.websocket import AsyncWebsocketConsumer
-from .scribo_handler import ScriboHandler
-from .serializers import CourseWithModulesSerializer, PageSerializer, ModuleSerializer
-from .models import Course, Module, StatusEnum
-import markdown
-import redis
+import time
+import uuid
+from urllib.parse import parse_qs
+import httpx
 from django.conf import settings
-
-redis_client = redis.StrictRedis.from_url(
-    settings.CACHES["default"]["LOCATION"], decode_responses=True
+from .scribo_handler import AsyncScriboHandler
+from .circuit_breaker import ScriboBusyError
+from .serializers import CourseWithModulesSerializer, PageSerializer, ModuleSerializer, VersionConflict
+from .models import Course, Module, StatusEnum
+from .redis_pool import async_redis
+from .rendering import arender
+from .db_pool import db_pool, db_task
+from .document_ops import EditRejected, apply_edit, op_log_key
+from .write_behind import flush_now, mark_dirty, save_module_content
+from . import presence
+from .framing import FramedWebsocketConsumer
+from .broadcast import BroadcastMixin
+from . import outline_history
+from .outline_history import HistoryError
+from .outline_patch import PatchError, apply_patch, changes_to_patch
+from .single_flight import RELEASE_LOCK
+from .prefetch import forget_prefetched, prefetch_key, remember_prefetched, take_prefetched
+from .room_cache import (
+    SET_PAGE_CONTENT,
+    Scopes,
+    get_outline,
+    invalidation_listener,
+    patch_outline,
+    refresh_page_ttl,
+    set_outline,
 )
 
+async def get_cached(key):
+    cached_data = await async_redis().get(key)
+    return json.loads(cached_data) if cached_data else {}
+
+
+async def set_page(room_name, page_data):
+    """Caches a freshly loaded page, starting its edit history over."""
+    page_data.setdefault("version", 0)
+
+    pipe = async_redis().pipeline()
+    pipe.set(f"page:{room_name}", json.dumps(page_data), ex=settings.ROOM_CACHE["PAGE_TTL"])
+    pipe.delete(op_log_key(room_name))
+    await pipe.execute()
+
+
+async def delete_page(room_name):
+    await async_redis().delete(f"page:{room_name}", op_log_key(room_name), prefetch_key(room_name))
+
+
+async def evict_page(room_name):
+    """Drops the cached page once the room has no members left."""
+    return await presence.evict_if_empty(
+        room_name, f"page:{room_name}", op_log_key(room_name), prefetch_key(room_name)
+    )
+
+
+async def set_page_content(room_name, content, module_uuid=None):
+    """
+    Writes content into page:{room} and returns the updated page, or None
+    if there is no cached page (or it moved on from `module_uuid`).
+    """
+    script = async_redis().register_script(SET_PAGE_CONTENT)
+    args = [content] if module_uuid is None else [content, module_uuid]
+
+    page = await script(keys=[f"page:{room_name}", op_log_key(room_name)], args=args)
+    return json.loads(page) if page else None
+
+
+def generating_key(room_name):
+    return f"generating:{room_name}"
+
+
+@db_task
+def get_page_request(module_uuid):
+    module = Module.objects.get(uuid=module_uuid)
+    return AsyncScriboHandler().page_request(module.course.title, [module])
+
+
+@db_task
+def load_first_page(course_uuid):
+    course = Course.objects.get(uuid=course_uuid)
+    return PageSerializer({"course": course.uuid}).data
+
+
+@db_task
+def load_page(module_uuid):
+    return PageSerializer({"currentPage": module_uuid}).data
+
 
-class DocumentConsumer(AsyncWebsocketConsumer):
+@db_task
+def load_outline(course_uuid):
+    course = Course.objects.get(uuid=course_uuid)
+    return CourseWithModulesSerializer(course).data
+
+
+class DocumentConsumer(BroadcastMixin, FramedWebsocketConsumer):
     async def connect(self):
         self.room_name = self.scope["url_route"]["kwargs"]["doc_id"]
         self.room_group_name = f"document_{self.room_name}"
+        self.generation = None
+        self.heartbeats = None
+        self.prefetching = None
+
+        # ?render=html adds the rendered page next to the markdown,
+        # ?presence=1 subscribes to the room's member list
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        self.render_html = query.get("render", [None])[0] == "html"
+        self.show_presence = query.get("presence", [None])[0] in ("1", "true")
+
+        user = self.scope.get("user")
+        self.member = {
+            "user": user.username if user and user.is_authenticated else None,
+            "since": time.time(),
+        }
 
         # Join room group
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
         await self.accept()
 
+        # Present before reading the page, so the last member leaving
+        # meanwhile cannot evict it from under us
+        await presence.heartbeat(self.room_name, self.channel_name, self.member)
+        self.heartbeats = asyncio.ensure_future(self.keep_alive())
+        invalidation_listener().register(self.room_group_name, self)
+
         uuid = self.scope["url_route"]["kwargs"]["doc_id"]
 
-        cached_data = redis_client.get(f"page:{uuid}")
-        cached_data = json.loads(cached_data) if cached_data else {}
+        cached_data = await get_cached(f"page:{uuid}")
 
         if cached_data:
             page_data = cached_data
         else:
-            course = Course.objects.get(uuid=uuid)
-            page_serializer = PageSerializer({"course": course.uuid})
-            page_data = page_serializer.data
+            page_data = await load_first_page(uuid)
 
-            redis_client.set(f"page:{uuid}", json.dumps(page_data))
+            await set_page(uuid, page_data)
 
         message = {
             "status": "good",
@@ -43,59 +146,126 @@ class DocumentConsumer(AsyncWebsocketConsumer):
             "meta": page_data,
         }
 
-        await self.send(text_data=json.dumps(message))
+        await self.send_message(await self.with_html(message))
+        await self.broadcast_presence()
+
+        self.prefetch(message["meta"])
+
+    async def keep_alive(self):
+        interval = settings.DOCUMENT_EDITING["HEARTBEAT_INTERVAL"]
+
+        while True:
+            await asyncio.sleep(interval)
+            await refresh_page_ttl(self.room_name)
+            if await presence.heartbeat(self.room_name, self.channel_name, self.member):
+                # dropped members that stopped heartbeating
+                await self.broadcast_presence()
+
+    async def broadcast_presence(self):
+        await self.broadcast(
+            {
+                "type": "presence_update",
+                "status": "presence",
+                "data": {"members": await presence.members(self.room_name)},
+            },
+        )
+
+    async def with_html(self, message):
+        content = message["data"].get("content")
+
+        if self.render_html and content:
+            message["data"]["html"] = await DocumentActions().render(content)
+        return message
 
     async def disconnect(self, close_code):
-        redis_client.delete(f"page:{self.room_name}")
+        if self.generation and not self.generation.done():
+            self.generation.cancel()
+        if self.heartbeats:
+            self.heartbeats.cancel()
+        if self.prefetching and not self.prefetching.done():
+            self.prefetching.cancel()
+
+        invalidation_listener().unregister(self.room_group_name, self)
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+        # The shared page outlives everyone but the last member to leave
+        if await presence.leave(self.room_name, self.channel_name):
+            await self.broadcast_presence()
+        elif await flush_now(self.room_name):
+            await evict_page(self.room_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        data = self.decode_message(text_data, bytes_data)
 
         response_data = data.get("data", {})
 
         action = data.get("action", None)
 
-        cached_data: dict = json.loads(redis_client.get(f"page:{self.room_name}"))
+        if action == "edit":
+            await self.edit(response_data)
+            return
 
-        if action == "next" and cached_data.get("nextPage"):
-            page_serializer = PageSerializer(
-                {"currentPage": cached_data.get("nextPage")}
-            )
-            response_data = page_serializer.data
+        if action == "presence":
+            members = await presence.members(self.room_name)
+
+            await self.send_message({"status": "presence", "data": {"members": members}})
+            return
+
+        if action == None and response_data:
+            # Edits read-modify-write the cached page in one round-trip
+            cached_data: dict = await set_page_content(self.room_name, response_data["content"]) or {}
+            response_data = dict(cached_data)
+
+            if cached_data:
+                await mark_dirty(self.room_name)
+        else:
+            cached_data: dict = await get_cached(f"page:{self.room_name}")
 
-            # Update in Redis
-            redis_client.set(f"page:{self.room_name}", json.dumps(response_data))
+        if action == "next" and cached_data.get("nextPage"):
+            response_data = await self.turn_page(cached_data.get("nextPage"))
 
         if action == "back" and cached_data.get("prevPage", None):
-            page_serializer = PageSerializer(
-                {"currentPage": cached_data.get("prevPage")}
-            )
-            response_data = page_serializer.data
+            response_data = await self.turn_page(cached_data.get("prevPage"))
 
-            # Update in Redis
-            redis_client.set(f"page:{self.room_name}", json.dumps(response_data))
+        if response_data is None:
+            return
 
         if action == "save":
-            cached_data = json.loads(redis_client.get(f"page:{self.room_name}"))
+            # Edits are written behind; saving just stops waiting for it
+            if not await flush_now(self.room_name):
+                await self.send_unsaved()
+                return
 
-            try:
-                module = Module.objects.get(uuid=cached_data.get("currentPage"))
-                module["content"] = cached_data.get("content")
-                module.save()
-            except Module.DoesNotExist:
-                print(f'No module matched with uuid {cached_data.get("currentPage")}')
+        if action == "generate":
+            """
+            Streams freshly generated content for the current page to the room
+            """
+            idle = not (self.generation and not self.generation.done())
+
+            if idle and cached_data.get("currentPage"):
+                # One generation per room, whichever socket or worker asks
+                token = str(uuid.uuid4())
+                started = await async_redis().set(
+                    generating_key(self.room_name), token, nx=True, ex=settings.DOCUMENT_EDITING["GENERATION_TTL"]
+                )
+
+                if started:
+                    self.generation = asyncio.ensure_future(
+                        self.stream_generation(cached_data.get("currentPage"), token)
+                    )
+                else:
+                    await self.send_message({"status": "busy", "message": "This page is already being generated."})
+            return
 
         if action == "clear":
-            redis_client.delete(f"page:{self.room_name}")
+            if not await flush_now(self.room_name):
+                await self.send_unsaved()
+                return
 
-            await self.send(text_data=json.dumps({"status": "cleared"}))
-            return
+            await delete_page(self.room_name)
 
-        if action == None and response_data:
-            cached_data["content"] = response_data["content"]
-            response_data = cached_data
-            redis_client.set(f"page:{self.room_name}", json.dumps(cached_data))
+            await self.send_message({"status": "cleared"})
+            return
 
         if not response_data.get("content", None):
             response_data["content"] = cached_data.get("content")
@@ -103,8 +273,7 @@ class DocumentConsumer(AsyncWebsocketConsumer):
         response_data["currentPage"] = cached_data.get("currentPage")
 
         # Broadcast changes to all users in the room
-        await self.channel_layer.group_send(
-            self.room_group_name,
+        await self.broadcast(
             {
                 "type": "document_update",
                 "status": "good",
@@ -115,80 +284,360 @@ class DocumentConsumer(AsyncWebsocketConsumer):
             },
         )
 
+    async def turn_page(self, module_uuid):
+        """
+        Shows another module, from the prefetched pages when it is there.
+        Returns None, staying on the page, if its edits could not be saved.
+        """
+        if not await flush_now(self.room_name):
+            await self.send_unsaved()
+            return None
+        # re-read: deltas may have landed since receive read the page
+        leaving = await get_cached(f"page:{self.room_name}")
+
+        page_data = await take_prefetched(self.room_name, module_uuid) or await load_page(module_uuid)
+
+        # Update in Redis
+        await set_page(self.room_name, page_data)
+        # the page being left is a neighbour now, with the content just flushed
+        if leaving:
+            await remember_prefetched(self.room_name, [leaving])
+
+        self.prefetch(page_data)
+        return page_data
+
+    async def send_unsaved(self):
+        # the edits stay in Redis and the flush is retried
+        await self.send_message({"status": "bad", "message": "Edits could not be saved yet, try again shortly."})
+
+    def prefetch(self, page_data):
+        """Warms the pages around the one just shown in the background."""
+        if self.prefetching and not self.prefetching.done():
+            self.prefetching.cancel()
+        self.prefetching = asyncio.ensure_future(self.prefetch_neighbours(dict(page_data)))
+
+    async def prefetch_neighbours(self, page_data):
+        depth = settings.DOCUMENT_EDITING["PREFETCH_DEPTH"]
+        window = {page_data.get("currentPage")}
+        loaded = []
+
+        try:
+            for link in ("prevPage", "nextPage"):
+                page = page_data
+
+                for _ in range(depth):
+                    module_uuid = page.get(link)
+                    if not module_uuid:
+                        break
+
+                    window.add(module_uuid)
+                    page = await take_prefetched(self.room_name, module_uuid)
+
+                    if page is None:
+                        page = await load_page(module_uuid)
+                        loaded.append(page)
+
+            await remember_prefetched(self.room_name, loaded, window)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Prefetching around page {page_data.get('currentPage')} failed: {e}")
+
+    async def edit(self, edit):
+        """
+        Applies positional ops to the current page and broadcasts only the delta.
+
+        Data: {"page": Module.uuid, "version": int, "ops": [{"p": int, "i": str} | {"p": int, "d": int}]}
+        """
+        if not isinstance(edit, dict):
+            edit = {}
+        module_uuid = edit.get("page")
+
+        try:
+            version, ops = await apply_edit(
+                self.room_name, module_uuid, edit.get("version"), edit.get("ops")
+            )
+        except EditRejected as e:
+            # Only the sender is out of step; hand it the whole page again
+            page_data = await get_cached(f"page:{self.room_name}")
+
+            await self.send_message({
+                "status": "resync",
+                "message": str(e),
+                "data": {"content": page_data.pop("content", None)},
+                "meta": page_data,
+            })
+            return
+
+        await mark_dirty(self.room_name)
+
+        await self.broadcast(
+            {
+                "type": "document_delta",
+                "status": "good",
+                "data": {"ops": ops, "version": version},
+                "meta": {"currentPage": module_uuid, "author": self.channel_name},
+            },
+        )
+
+    async def stream_generation(self, module_uuid, token):
+        """
+        Generates the page while holding the room's generating lock, taken
+        by "generate" with `token`, and releases it however it ends
+        """
+        try:
+            await self.relay_generation(module_uuid)
+        finally:
+            await async_redis().eval(RELEASE_LOCK, 1, generating_key(self.room_name), token)
+
+    async def generation_failed(self, module_uuid, status):
+        await self.broadcast(
+            {
+                "type": "document_stream",
+                "status": status,
+                "data": {"delta": ""},
+                "meta": {"currentPage": module_uuid},
+            },
+        )
+
+    async def relay_generation(self, module_uuid):
+        """
+        Relays generated content to the room as it arrives and persists the
+        full text once the stream completes
+        """
+        try:
+            request = await get_page_request(module_uuid)
+        except Module.DoesNotExist:
+            print(f"Generation for module {module_uuid} failed: the module no longer exists")
+            await self.generation_failed(module_uuid, "bad")
+            return
+
+        chunks = []
+
+        try:
+            async for delta in DocumentActions().stream(request):
+                chunks.append(delta)
+
+                await self.broadcast(
+                    {
+                        "type": "document_stream",
+                        "status": "generating",
+                        "data": {"delta": delta},
+                        "meta": {"currentPage": module_uuid},
+                    },
+                )
+        except (httpx.HTTPError, ScriboBusyError) as e:
+            print(f"Generation for module {module_uuid} failed: {e}")
+
+            await self.generation_failed(module_uuid, "busy" if isinstance(e, ScriboBusyError) else "bad")
+            return
+
+        content = "".join(chunks)
+
+        await save_module_content(module_uuid, content)
+
+        page_data = await set_page_content(self.room_name, content, module_uuid) or {}
+
+        page_data.pop("content", None)
+        page_data["currentPage"] = module_uuid
+
+        await self.broadcast(
+            {
+                "type": "document_update",
+                "status": "good",
+                "data": {"content": content},
+                "meta": page_data,
+            },
+        )
+
+    async def cache_invalidated(self, event):
+        """Another process changed this course's pages; resend the current one."""
+        if event["scope"] == Scopes.DELETED:
+            await self.send_message({"status": "deleted"})
+            return
+
+        page_data = await get_cached(f"page:{self.room_name}")
+
+        if page_data:
+            message = {"status": "good", "data": {"content": page_data.pop("content", None)}, "meta": page_data}
+            await self.send_message(await self.with_html(message))
+            self.prefetch(page_data)
+
     async def document_update(self, event):
         message = {
             "status": event["status"],
             "data": event["data"],
             "meta": event["meta"],
         }
-        await self.send(text_data=json.dumps(message))
+        await self.send_message(await self.with_html(message))
+
+    async def document_delta(self, event):
+        message = {
+            "status": event["status"],
+            "data": event["data"],
+            "meta": {
+                "currentPage": event["meta"]["currentPage"],
+                # the sender's own delta doubles as the acknowledgement
+                "ack": event["meta"]["author"] == self.channel_name,
+            },
+        }
+        await self.send_message(message)
+
+    async def document_stream(self, event):
+        message = {
+            "status": event["status"],
+            "data": event["data"],
+            "meta": event["meta"],
+        }
+        await self.send_message(message)
+
+    async def presence_update(self, event):
+        if self.show_presence:
+            message = {"status": event["status"], "data": event["data"]}
+            await self.send_message(message)
+
+    async def job_update(self, event):
+        message = {"status": event["status"], "job": event["job"]}
+        await self.send_message(message)
 
 
 class DocumentActions:
     def __init__(self):
-        self.scribo = ScriboHandler()
+        self.scribo = AsyncScriboHandler()
+
+    async def generate(self, data):
+        """
+        Generates pages and returns them rendered, keyed by module name
+        """
+        pages = await self.scribo.generate_page(data)
+
+        if not isinstance(pages, dict):
+            return {}
+
+        return {name: await self.render(content) for name, content in pages.items()}
 
-    def generate(self):
-        md = markdown.Markdown(extensions=["fenced_code"])
-        content = md.convert(self.scribo.generate_page())
-        return content
+    async def render(self, content):
+        return await arender(content)
 
+    def stream(self, data):
+        return self.scribo.stream_page(data)
 
-class OutlineConsumer(AsyncWebsocketConsumer):
+
+class OutlineConsumer(BroadcastMixin, FramedWebsocketConsumer):
     async def connect(self):
         self.room_name = self.scope["url_route"]["kwargs"]["cor_uuid"]
         self.room_group_name = f"course_{self.room_name}"
 
+        # ?patches=1 receives outline changes as patches instead of the whole outline
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        self.accept_patches = query.get("patches", [None])[0] in ("1", "true")
+
         # Join room group
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
         await self.accept()
+        invalidation_listener().register(self.room_group_name, self)
 
-        uuid = self.scope["url_route"]["kwargs"]["cor_uuid"]
+        _, course_data = await self.current_outline()
 
-        cached_data = redis_client.get(f"course:{uuid}")
-        cached_data = json.loads(cached_data) if cached_data else {}
+        message = {"status": "good", "data": {"script": course_data}}
 
-        if cached_data:
-            course_data = cached_data
-        else:
-            course = Course.objects.get(uuid=uuid)
-            serialized = CourseWithModulesSerializer(course)
-            course_data = serialized.data
+        # Sends back the current state of the outline
+        await self.send_message(message)
 
-            redis_client.set(f"course:{uuid}", json.dumps(course_data))
+    async def current_outline(self):
+        """The cached outline and its generation, loaded from the db on a miss."""
+        generation, course_data = await get_outline(self.room_name)
 
-        message = {"status": "good", "data": {"script": course_data}}
+        if not course_data:
+            course_data = await load_outline(self.room_name)
 
-        # Sends back the current state of the outline
-        await self.send(text_data=json.dumps(message))
+            # After an invalidation every consumer on every worker misses at
+            # once; only the one that fills the cache records the db outline
+            # as a version of its own
+            if await set_outline(self.room_name, generation, course_data, nx=True):
+                await outline_history.record(self.room_name, course_data)
+
+        return generation, course_data
 
     async def disconnect(self, close_code):
+        invalidation_listener().unregister(self.room_group_name, self)
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         """Data:
 
         {
             "status": "good" | "bad",
-            "action": "update" | "save" | "change" | null,
+            "action": "update" | "save" | "change" | "patch"
+                | "undo" | "redo" | "restore" | "history"
+                | "reload" | "rebase" | null,
             "data": {
                 "changes": {},
-                "comments": str | null
+                "patch": [],  # RFC 6902-style ops, see outline_patch
+                "comments": str | null,
+                "refresh": bool,  # skip the cached response on "update"
+                "version": int  # for "restore"
             }
         }
         """
-        data = json.loads(text_data)
-        cached_data: dict = json.loads(redis_client.get(f"course:{self.room_name}"))
+        data = self.decode_message(text_data, bytes_data)
+        action = data.get("action", "")
+
+        if action == "patch" and data.get("data", {}).get("patch", None):
+            await self.patch(data["data"]["patch"])
+            return
+
+        generation, cached_data = await self.current_outline()
         status = "good"
         content = None
+        diff = None
 
-        action = data.get("action", "")
+        if action == "history":
+            summary = await outline_history.summary(self.room_name)
+            await self.send_message({"status": "history", "data": summary})
+            return
+
+        if action in ("undo", "redo", "restore"):
+            """
+            Moves the outline through its history, see outline_history
+            """
+            try:
+                if action == "restore":
+                    _, content = await outline_history.restore(
+                        self.room_name, int(data.get("data", {}).get("version"))
+                    )
+                else:
+                    _, content = await getattr(outline_history, action)(self.room_name)
+            except (HistoryError, TypeError, ValueError) as e:
+                await self.send_message({"status": "bad", "message": str(e)})
+                return
+
+            content = outline_history.with_versions(content, cached_data)
+
+        if action in ("reload", "rebase"):
+            """
+            Resolves a save conflict: take the stored outline, or keep the
+            room's edits on top of the stored versions so the next save wins
+            """
+            stored = await load_outline(self.room_name)
+
+            if action == "reload":
+                content = stored
+            else:
+                content = outline_history.with_versions(cached_data, stored)
+
+            await outline_history.record(self.room_name, content)
 
         if action == "change" and data.get("data", {}).get("changes", None):
             changes = data.get("data", {}).get("changes", None)
 
             message = {"original": cached_data, "changes": changes}
-            content, status = OutlineActions().change(message)
+            try:
+                content, status, diff = OutlineActions().change(message)
+            except PatchError as e:
+                # Nothing was applied; only the sender needs to know
+                await self.send_message({"status": "bad", "message": str(e)})
+                return
 
         if action == "update" and data.get("data", {}).get("comments", None):
             """
@@ -197,8 +646,17 @@ class OutlineConsumer(AsyncWebsocketConsumer):
             messsage = {
                 "script": cached_data,
                 "comments": data.get("data", {}).get("comments", None),
+                "refresh": data.get("data", {}).get("refresh", False),
             }
-            content, status = OutlineActions().update(messsage)
+            try:
+                content, status, diff = await OutlineActions().update(messsage)
+            except ScriboBusyError as e:
+                # Only the requester hears about it; the outline is unchanged
+                await self.send_message({"status": "busy", "message": str(e)})
+                return
+            except PatchError as e:
+                await self.send_message({"status": "bad", "message": str(e)})
+                return
 
         if action == "save":
             """
@@ -207,50 +665,123 @@ class OutlineConsumer(AsyncWebsocketConsumer):
             message = {
                 "script": cached_data,
             }
-            content, status = OutlineActions().save(message)
+            content, status = await db_pool.run(OutlineActions().save, message)
+
+            if status == "conflict":
+                # Only the requester's save is stale; the room keeps its outline
+                await self.send_message({
+                    "status": "conflict",
+                    "message": (
+                        "The outline was saved elsewhere: \"reload\" to take that version, "
+                        "or \"rebase\" to keep these edits and save over it."
+                    ),
+                    "data": content,
+                })
+                return
+
+            if status == "good":
+                await outline_history.record(self.room_name, content)
 
         if content:
-            redis_client.set(f"course:{self.room_name}", json.dumps(content))
+            await set_outline(self.room_name, generation, content)
         else:
             content = cached_data
 
+        if diff is not None:
+            # Only what changed goes through the channel layer
+            if diff:
+                await outline_history.record(self.room_name, content, diff)
+                await self.broadcast(
+                    {"type": "outline_patch", "patch": diff, "status": status},
+                )
+            else:
+                # Nothing changed; the sender still gets its answer
+                await self.outline_patch({"patch": diff, "status": status})
+            return
+
         # Broadcast changes to all users in the room
-        await self.channel_layer.group_send(
-            self.room_group_name,
+        await self.broadcast(
             {"type": "outline_update", "script": content, "status": status},
         )
 
+    async def patch(self, patch):
+        """
+        Applies a patch to the cached outline in place, touching only the
+        modules it names, and broadcasts the ops that took effect.
+        """
+        try:
+            patched = await patch_outline(self.room_name, patch)
+            while patched is None:
+                # nothing cached for this generation yet
+                await self.current_outline()
+                patched = await patch_outline(self.room_name, patch)
+        except PatchError as e:
+            await self.send_message({"status": "bad", "message": str(e)})
+            return
+
+        generation, diff = patched
+
+        if diff:
+            await outline_history.record(self.room_name, None, diff, generation)
+            await self.broadcast({"type": "outline_patch", "patch": diff, "status": "good"})
+        else:
+            # Nothing changed; the sender still gets its answer
+            await self.outline_patch({"patch": diff, "status": "good"})
+
     async def outline_update(self, event):
         message = {"status": event["status"], "data": {"script": event["script"]}}
-        await self.send(text_data=json.dumps(message))
+        await self.send_message(message)
+
+    async def outline_patch(self, event):
+        if self.accept_patches:
+            message = {"status": event["status"], "data": {"patch": event["patch"]}}
+        else:
+            # Clients without patch support get the outline the patch produced
+            _, script = await get_outline(self.room_name)
+            message = {"status": event["status"], "data": {"script": script}}
+        await self.send_message(message)
+
+    async def cache_invalidated(self, event):
+        """The course changed outside this socket; send the stored outline."""
+        if event["scope"] == Scopes.DELETED:
+            await self.send_message({"status": "deleted"})
+            return
+
+        _, course_data = await self.current_outline()
+        await self.send_message({"status": "good", "data": {"script": course_data}})
+
+    async def job_update(self, event):
+        message = {"status": event["status"], "job": event["job"]}
+        await self.send_message(message)
 
 
 class OutlineActions:
     def __init__(self):
-        self.scribo = ScriboHandler()
+        self.scribo = AsyncScriboHandler()
 
-    def update(self, data):
+    async def update(self, data):
         """
         Makes a Call to SCRIBO to update the course outline
         """
         content = data["script"]
         comments = data.get("comments", "")
 
+        use_cache = not data.get("refresh", False)
+
         data = {"notes": comments, "script": content}
 
-        course_outline = self.scribo.update_course_outline(data)
+        course_outline = await self.scribo.update_course_outline(data, use_cache=use_cache)
 
         message = {"original": content, "changes": course_outline}
 
-        updated, status = self.change(message)
-
-        return updated, status
+        return self.change(message)
 
     def save(self, data):
         """
-        Saves the outline to the db
+        Saves the outline to the db. A stale version returns the stored
+        outline and its version with a "conflict" status.
         """
-        content = data["script"]
+        content = {**data["script"], "status": StatusEnum.DRAFT.value}
 
         course_serializer = CourseWithModulesSerializer(
             data=content, context={"action": "update"}
@@ -264,11 +795,19 @@ class OutlineActions:
             except Course.DoesNotExist:
                 return content, "bad"
 
-            updated_course = course_serializer.update(course, content)
-            updated_course["status"] = StatusEnum.DRAFT.value
-            updated_course.save()
+            try:
+                course_serializer.update(course, content)
+            except VersionConflict as e:
+                print(e)
+                current = CourseWithModulesSerializer(Course.objects.get(pk=course.pk)).data
+                return {"script": current, "version": current["version"]}, "conflict"
 
-            content = course_serializer.data
+            # module order may have changed under the prefetched pages
+            forget_prefetched(course.uuid)
+
+            # From the saved instance: the validated data has no versions,
+            # and the next save from this outline is checked against them
+            content = CourseWithModulesSerializer(course).data
 
             return content, "good"
         else:
@@ -287,42 +826,13 @@ class OutlineActions:
         original = data.get("original", None)
         changes = data.get("changes", None)
 
-        modulesChanges = changes.pop("moduleChanges", None)
-
-        if modulesChanges:
-            # add new module
-            if "add" in modulesChanges:
-                if original["modules"]:
-                    original["modules"].extend(modulesChanges["add"])
-                else:
-                    original["modules"] = modulesChanges["add"]
-
-            # remove module
-            if "remove" in modulesChanges:
-                original["modules"] = [
-                    module
-                    for module in original["modules"]
-                    if module["uuid"] not in modulesChanges["remove"]
-                ]
-
-            # update existing module
-            if "update" in modulesChanges:
-                for changed_module in modulesChanges["update"]:
-                    module_index = next(
-                        (
-                            index
-                            for index, module in enumerate(original["modules"])
-                            if module["uuid"] == changed_module["uuid"]
-                        ),
-                        None,
-                    )
-                    if module_index is not None:
-                        original["modules"][module_index] = changed_module
-
-        # update keys where original matches with changes
-        for key in original:
-            if key in changes:
-                original[key] = changes[key]
+        return self.patch(original, changes_to_patch(original, changes))
 
-        return original, "good"
+    def patch(self, original, patch):
+        """
+        Applies a patch to the outline. Returns the outline, the status and
+        the ops that changed something, for broadcasting.
+        """
+        updated, diff = apply_patch(original, patch)
 
+        return updated, "good", diff
@@ -0,0 +1,77 @@
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+
+class DatabasePool:
+    """
+    Sized thread pool for the consumers' mongoengine work.
+
+    channels' database_sync_to_async runs everything on one shared thread,
+    so a single slow query holds up every socket on the worker. Here
+    queries run side by side, and the time each spends queued for a thread
+    is recorded so an undersized pool shows up in the stats.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="consumer-db")
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.started = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+
+    async def run(self, fn, *args, **kwargs):
+        submitted_at = time.monotonic()
+
+        with self.lock:
+            self.submitted += 1
+
+        def timed():
+            started_at = time.monotonic()
+            wait = started_at - submitted_at
+
+            with self.lock:
+                self.started += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.completed += 1
+                    self.total_run += time.monotonic() - started_at
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, timed)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "queued": self.submitted - self.started,
+                "running": self.started - self.completed,
+                "completed": self.completed,
+                "avg_wait_ms": self.total_wait / self.started * 1000 if self.started else 0.0,
+                "max_wait_ms": self.max_wait * 1000,
+                "avg_run_ms": self.total_run / self.completed * 1000 if self.completed else 0.0,
+            }
+
+
+db_pool = DatabasePool(settings.CONSUMER_DB_POOL["WORKERS"])
+
+
+def db_task(fn):
+    """Turns a blocking ORM function into a coroutine run on the db pool."""
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await db_pool.run(fn, *args, **kwargs)
+
+    return wrapper
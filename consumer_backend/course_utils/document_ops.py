@@ -0,0 +1,262 @@
+"""
+Operational transform for collaborative page edits.
+
+An edit is a list of primitive ops applied in order, with positions in
+Unicode code points:
+
+    {"p": 12, "i": "text"}   insert "text" before position 12
+    {"p": 12, "d": 3}        delete 3 characters starting at position 12
+
+Each edit names the page version it was made against. The cached page in
+Redis carries a version counter and a capped log of applied edits, so an
+edit made against an older version is rebased over the edits it missed
+before it is applied.
+"""
+import json
+from django.conf import settings
+from .redis_pool import async_redis
+
+
+class EditRejected(Exception):
+    """The edit cannot be applied; the client should resync the full page."""
+
+
+def op_log_key(room_name):
+    return f"page:{room_name}:ops"
+
+
+def validate(ops):
+    """Returns the ops as clean primitives, raising EditRejected if malformed."""
+    if not isinstance(ops, list):
+        raise EditRejected("ops must be a list")
+    if len(ops) > settings.DOCUMENT_EDITING["MAX_EDIT_OPS"]:
+        raise EditRejected("Too many ops in one edit, send the full page instead.")
+
+    clean = []
+    for op in ops:
+        if not isinstance(op, dict) or not isinstance(op.get("p"), int) or op["p"] < 0:
+            raise EditRejected(f"Invalid op {op}")
+
+        if isinstance(op.get("i"), str) and op["i"]:
+            clean.append({"p": op["p"], "i": op["i"]})
+        elif isinstance(op.get("d"), int) and op["d"] > 0:
+            clean.append({"p": op["p"], "d": op["d"]})
+        else:
+            raise EditRejected(f"Invalid op {op}")
+
+    return clean
+
+
+def apply(text, ops):
+    """Applies ops to a string. The Lua script below mirrors this."""
+    for op in ops:
+        if "i" in op:
+            text = text[:op["p"]] + op["i"] + text[op["p"]:]
+        else:
+            text = text[:op["p"]] + text[op["p"] + op["d"]:]
+    return text
+
+
+def transform_op(a, b, shift_on_tie):
+    """
+    Rebases primitive `a` over primitive `b`, both made against the same
+    text. Returns a list, since a delete can be split by an insert.
+    """
+    if "i" in a:
+        if "i" in b:
+            if b["p"] < a["p"] or (b["p"] == a["p"] and shift_on_tie):
+                return [{"p": a["p"] + len(b["i"]), "i": a["i"]}]
+            return [a]
+
+        if a["p"] <= b["p"]:
+            return [a]
+        if a["p"] >= b["p"] + b["d"]:
+            return [{"p": a["p"] - b["d"], "i": a["i"]}]
+        return [{"p": b["p"], "i": a["i"]}]
+
+    start, end = a["p"], a["p"] + a["d"]
+
+    if "i" in b:
+        if b["p"] <= start:
+            return [{"p": start + len(b["i"]), "d": a["d"]}]
+        if b["p"] >= end:
+            return [a]
+        # keep the other editor's insert: delete around it
+        before = b["p"] - start
+        return [
+            {"p": start, "d": before},
+            {"p": start + len(b["i"]), "d": a["d"] - before},
+        ]
+
+    b_start, b_end = b["p"], b["p"] + b["d"]
+
+    if end <= b_start:
+        return [a]
+    if b_end <= start:
+        return [{"p": start - b["d"], "d": a["d"]}]
+
+    overlap = min(end, b_end) - max(start, b_start)
+    remaining = a["d"] - overlap
+    return [{"p": min(start, b_start), "d": remaining}] if remaining else []
+
+
+def transform_over_op(ops, b, shift_on_tie):
+    """
+    Rebases the op list `ops` over the single op `b`. Also returns `b`
+    rebased over `ops`, which may have been split into pieces.
+    """
+    rebased = []
+    b_pieces = [b]
+
+    for a in ops:
+        a_pieces, b_pieces = transform_op_over(a, b_pieces, shift_on_tie)
+        rebased += a_pieces
+
+    return rebased, b_pieces
+
+
+def transform_op_over(a, ops, shift_on_tie):
+    """
+    Rebases the single op `a` over the op list `ops`. Also returns `ops`
+    rebased over `a`. Only a delete split by an insert yields two pieces,
+    and a single op cannot be split while splitting the other, so this
+    and transform_over_op nest a bounded number of times.
+    """
+    a_pieces = [a]
+    rebased = []
+
+    for b in ops:
+        if len(a_pieces) == 1:
+            b_after = transform_op(b, a_pieces[0], not shift_on_tie)
+            a_pieces = transform_op(a_pieces[0], b, shift_on_tie)
+        else:
+            a_pieces, b_after = transform_over_op(a_pieces, b, shift_on_tie)
+        rebased += b_after
+
+    return a_pieces, rebased
+
+
+def transform(ops, applied, shift_on_tie=True):
+    """
+    Rebases the op list `ops` over the op list `applied`, both made against
+    the same text. On inserts at the same position, already applied text
+    goes first when `shift_on_tie` is set. Iterative, so long edits over a
+    busy log cost time rather than stack.
+    """
+    for b in applied:
+        ops, _ = transform_over_op(ops, b, shift_on_tie)
+    return ops
+
+
+# Applies an edit to page:{room} if it was made against the current version.
+# KEYS: page, op log. ARGV: module uuid, base version, ops json, log size.
+# Returns {1, version} when applied, {0, version, entries...} with the log
+# entries the edit missed, {-1} if the page moved on and {-2} if the edit is
+# older than the log. The page is rewritten whole: Redis strings can't take
+# an insert in place.
+APPLY_EDIT = """
+local page = redis.call("get", KEYS[1])
+if not page then
+    return {-1}
+end
+
+local data = cjson.decode(page)
+if data["currentPage"] ~= ARGV[1] then
+    return {-1}
+end
+
+local version = tonumber(data["version"]) or 0
+local base = tonumber(ARGV[2])
+
+if base ~= version then
+    local missed = version - base
+    if base > version or missed > redis.call("llen", KEYS[2]) then
+        return {-2}
+    end
+
+    local result = {0, version}
+    for _, entry in ipairs(redis.call("lrange", KEYS[2], -missed, -1)) do
+        table.insert(result, entry)
+    end
+    return result
+end
+
+-- byte index of the character at code point `position` in a UTF-8 string
+local function byte_index(text, position)
+    local index, count = 1, 0
+    while index <= #text and count < position do
+        local c = text:byte(index)
+        if c < 0x80 then
+            index = index + 1
+        elseif c < 0xE0 then
+            index = index + 2
+        elseif c < 0xF0 then
+            index = index + 3
+        else
+            index = index + 4
+        end
+        count = count + 1
+    end
+    return index
+end
+
+local text = data["content"]
+if type(text) ~= "string" then
+    text = ""
+end
+
+for _, op in ipairs(cjson.decode(ARGV[3])) do
+    local at = byte_index(text, op["p"])
+    if op["i"] then
+        text = text:sub(1, at - 1) .. op["i"] .. text:sub(at)
+    else
+        text = text:sub(1, at - 1) .. text:sub(byte_index(text, op["p"] + op["d"]))
+    end
+end
+
+version = version + 1
+data["content"] = text
+data["version"] = version
+
+redis.call("set", KEYS[1], cjson.encode(data), "KEEPTTL")
+redis.call("rpush", KEYS[2], '{"v":' .. version .. ',"ops":' .. ARGV[3] .. '}')
+redis.call("ltrim", KEYS[2], -tonumber(ARGV[4]), -1)
+
+return {1, version}
+"""
+
+
+async def apply_edit(room_name, module_uuid, version, ops, retries=5):
+    """
+    Applies an edit to the room's cached page, rebasing it over any edits
+    it missed. Only the ops travel to Redis, so the socket never sends or
+    parses the page; inside Redis, though, the script decodes the page,
+    splices the text and sets it again, which costs the size of the page
+    per edit. Returns the new version and the ops as applied.
+    """
+    if not isinstance(module_uuid, str) or not module_uuid:
+        raise EditRejected("page must be a module uuid")
+    # bool is an int too
+    if not isinstance(version, int) or isinstance(version, bool) or version < 0:
+        raise EditRejected("version must be a page version")
+
+    ops = validate(ops)
+    script = async_redis().register_script(APPLY_EDIT)
+    log_size = settings.DOCUMENT_EDITING["OP_LOG_SIZE"]
+
+    for _ in range(retries):
+        result = await script(
+            keys=[f"page:{room_name}", op_log_key(room_name)],
+            args=[module_uuid, version, json.dumps(ops), log_size],
+        )
+
+        if result[0] == 1:
+            return result[1], ops
+        if result[0] < 0:
+            raise EditRejected("The edit no longer matches the page.")
+
+        for entry in result[2:]:
+            ops = transform(ops, json.loads(entry)["ops"])
+        version = result[1]
+
+    raise EditRejected("Too many concurrent edits, resync and retry.")
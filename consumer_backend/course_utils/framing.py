@@ -0,0 +1,108 @@
+"""
+Message framing for the course sockets.
+
+Clients pick a format with the WebSocket subprotocol header:
+
+    new WebSocket(url, ["scribo.msgpack.zlib", "scribo.msgpack"])
+
+``scribo.msgpack`` sends binary msgpack frames. ``scribo.msgpack.zlib``
+does the same, with a one byte header on every frame: 0 for a plain body,
+1 for a zlib-compressed one (only frames over ``COMPRESS_MIN_BYTES`` are
+compressed). A compressed frame may inflate to ``MAX_FRAME_BYTES`` at
+most. Clients that offer neither get JSON text frames, as before.
+"""
+import json
+import zlib
+import msgpack
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+
+PLAIN = b"\x00"
+DEFLATED = b"\x01"
+
+
+class FrameTooLarge(ValueError):
+    """A compressed frame inflates past MAX_FRAME_BYTES."""
+
+
+def inflate(body):
+    """Decompresses a frame body, stopping at MAX_FRAME_BYTES instead of exhausting memory."""
+    limit = settings.SOCKET_FRAMING["MAX_FRAME_BYTES"]
+    decompressor = zlib.decompressobj()
+    inflated = decompressor.decompress(body, limit)
+
+    # output held back at the limit leaves the stream unfinished too
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise FrameTooLarge(f"Frame does not inflate within {limit} bytes")
+    return inflated
+
+
+class JsonCodec:
+    subprotocol = None
+
+    def encode(self, message):
+        return {"text_data": json.dumps(message)}
+
+    def decode(self, text_data=None, bytes_data=None):
+        return json.loads(text_data if text_data is not None else bytes_data)
+
+
+class MsgpackCodec(JsonCodec):
+    subprotocol = "scribo.msgpack"
+
+    def encode(self, message):
+        return {"bytes_data": msgpack.packb(message)}
+
+    def decode(self, text_data=None, bytes_data=None):
+        # text frames stay JSON, so a client can switch formats gradually
+        if bytes_data is None:
+            return super().decode(text_data)
+        return msgpack.unpackb(bytes_data)
+
+
+class ZlibMsgpackCodec(MsgpackCodec):
+    subprotocol = "scribo.msgpack.zlib"
+
+    def encode(self, message):
+        body = msgpack.packb(message)
+
+        if len(body) < settings.SOCKET_FRAMING["COMPRESS_MIN_BYTES"]:
+            return {"bytes_data": PLAIN + body}
+        return {"bytes_data": DEFLATED + zlib.compress(body, settings.SOCKET_FRAMING["COMPRESS_LEVEL"])}
+
+    def decode(self, text_data=None, bytes_data=None):
+        if bytes_data is None:
+            return super().decode(text_data)
+
+        header, body = bytes_data[:1], bytes_data[1:]
+        return msgpack.unpackb(inflate(body) if header == DEFLATED else body)
+
+
+# In order of preference when a client offers several
+CODECS = [ZlibMsgpackCodec(), MsgpackCodec()]
+
+
+def negotiate(offered):
+    for codec in CODECS:
+        if codec.subprotocol in offered:
+            return codec
+    return JsonCodec()
+
+
+class FramedWebsocketConsumer(AsyncWebsocketConsumer):
+    """
+    Consumer that speaks whichever format the client negotiated. Use
+    send_message and decode_message instead of json.dumps and json.loads.
+    """
+
+    codec = JsonCodec()
+
+    async def accept(self, subprotocol=None, headers=None):
+        self.codec = negotiate(self.scope.get("subprotocols", []))
+        await super().accept(subprotocol or self.codec.subprotocol, headers)
+
+    async def send_message(self, message):
+        await self.send(**self.codec.encode(message))
+
+    def decode_message(self, text_data=None, bytes_data=None):
+        return self.codec.decode(text_data, bytes_data)
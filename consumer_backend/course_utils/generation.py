@@ -0,0 +1,94 @@
+import asyncio
+import httpx
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings
+from .circuit_breaker import ScriboBusyError
+from .models import Module
+from .room_cache import invalidate_pages
+from .scribo_handler import AsyncScriboHandler, ScriboHandler
+
+EMPTY_CONTENT = "No data."
+
+
+def pending_modules(course):
+    """Modules of a course that have no generated content yet, in order."""
+    return [
+        module
+        for module in Module.objects.filter(course=course).order_by('order')
+        if module.content == EMPTY_CONTENT
+    ]
+
+
+def generate_pages(course, modules):
+    """
+    Generates every module in one request to the model server and saves
+    them afterwards. Returns the uuids of the modules left without content.
+    """
+    scribo = ScriboHandler()
+
+    try:
+        generated_pages = scribo.generate_page(scribo.page_request(course.title, modules))
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"No content generated for course {course.uuid}: {e}")
+        return [module.uuid for module in modules]
+
+    if not isinstance(generated_pages, dict):
+        return [module.uuid for module in modules]
+
+    for module in modules:
+        module.content = generated_pages.get(module.name, EMPTY_CONTENT)
+        module.save()
+
+    invalidate_pages(course.uuid, {module.uuid: module.content for module in modules})
+
+    return [module.uuid for module in modules if module.content == EMPTY_CONTENT]
+
+
+async def generate_pages_concurrently(course, modules, concurrency=None, on_saved=None):
+    """
+    Sends one request per module, at most `concurrency` at a time, and saves
+    each module as soon as its content arrives. Modules the model server is
+    too busy for, or that fail, keep "No data." so a later run picks them
+    up; their uuids are returned.
+
+    `on_saved` is awaited with each module after it is saved. The model
+    server client is closed on return unless the loop had one already.
+    """
+    scribo = AsyncScriboHandler()
+    semaphore = asyncio.Semaphore(concurrency or settings.SCRIBO["PAGE_CONCURRENCY"])
+    saved = {}
+
+    async def generate(module):
+        async with semaphore:
+            try:
+                generated_pages = await scribo.generate_page(scribo.page_request(course.title, [module]))
+            except (ScriboBusyError, httpx.HTTPError, ValueError) as e:
+                print(f"Skipped module {module.uuid}: {e}")
+                return
+
+        if not isinstance(generated_pages, dict) or not generated_pages.get(module.name):
+            print(f"No content generated for module {module.uuid}")
+            return
+
+        module.content = generated_pages[module.name]
+        await database_sync_to_async(module.save)()
+        saved[module.uuid] = module.content
+
+        if on_saved:
+            await on_saved(module)
+
+    try:
+        # the sync views and jobs call this on a loop that ends with it
+        async with AsyncScriboHandler.scoped():
+            # one module failing must not abandon the others mid-request
+            results = await asyncio.gather(*(generate(module) for module in modules), return_exceptions=True)
+    finally:
+        if saved:
+            await sync_to_async(invalidate_pages)(course.uuid, saved)
+
+    for module, result in zip(modules, results):
+        if isinstance(result, Exception):
+            print(f"Generating module {module.uuid} failed: {result!r}")
+
+    return [module.uuid for module in modules if module.uuid not in saved]
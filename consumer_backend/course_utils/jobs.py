@@ -0,0 +1,266 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from .generation import pending_modules, generate_pages_concurrently
+from .models import Course
+from .redis_pool import redis_client
+from .scribo_handler import ScriboHandler
+from .serializers import CourseWithModulesSerializer
+
+JOB_QUEUE = "scribo:jobs"
+JOB_TTL = 60 * 60 * 24  # job records are kept for a day
+WORKER_TTL = 30  # a worker that stops refreshing its key this long is dead
+MAX_ATTEMPTS = 3  # runs a job gets before a dying worker marks it failed
+
+
+class JobTypes:
+    OUTLINE = "outline"
+    PAGES = "pages"
+
+
+class JobStatuses:
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+def job_key(job_id):
+    return f"job:{job_id}"
+
+
+def enqueue(job_type, payload):
+    """
+    Records a job and pushes it onto the queue. Returns the job id.
+    """
+    job_id = str(uuid.uuid4())
+
+    pipe = redis_client.pipeline()
+    pipe.hset(job_key(job_id), mapping={
+        "id": job_id,
+        "type": job_type,
+        "status": JobStatuses.QUEUED,
+        "payload": json.dumps(payload),
+        "created_at": time.time(),
+    })
+    pipe.expire(job_key(job_id), JOB_TTL)
+    pipe.rpush(JOB_QUEUE, job_id)
+    pipe.execute()
+
+    return job_id
+
+
+def get_job(job_id):
+    job = redis_client.hgetall(job_key(job_id))
+
+    if not job:
+        return None
+
+    job.pop("payload", None)
+    for field in ("progress", "result"):
+        if field in job:
+            job[field] = json.loads(job[field])
+
+    return job
+
+
+def update_job(job_id, **fields):
+    for field in ("progress", "result"):
+        if field in fields:
+            fields[field] = json.dumps(fields[field])
+
+    redis_client.hset(job_key(job_id), mapping=fields)
+
+
+async def apublish(group, job_id, status, **data):
+    """
+    Pushes a job event to a course/document channel group.
+    """
+    await get_channel_layer().group_send(
+        group,
+        {
+            "type": "job_update",
+            "status": status,
+            "job": {"id": job_id, **data},
+        },
+    )
+
+
+def publish(group, job_id, status, **data):
+    async_to_sync(apublish)(group, job_id, status, **data)
+
+
+def run_outline_job(job_id, payload):
+    """
+    Generates a course outline and saves it for the organization.
+    """
+    course_outline = ScriboHandler().generate_course_outline(
+        payload["data"], use_cache=payload.get("use_cache", True)
+    )
+
+    course_outline["organization"] = payload["organization"]
+
+    course_serializer = CourseWithModulesSerializer(data=course_outline)
+
+    if not course_serializer.is_valid():
+        raise Exception(json.dumps(course_serializer.errors))
+
+    course = course_serializer.save()
+
+    publish(f"course_{course.uuid}", job_id, JobStatuses.DONE, course=course.uuid)
+
+    return {"uuid": course.uuid}
+
+
+def run_pages_job(job_id, payload):
+    """
+    Generates the pending pages of a course, reporting each saved module.
+    """
+    course = Course.objects.get(uuid=payload["course"])
+    modules = pending_modules(course)
+    group = job_group(JobTypes.PAGES, payload)
+    progress = {"completed": 0, "total": len(modules)}
+
+    update_job(job_id, progress=progress)
+
+    async def on_saved(module):
+        progress["completed"] += 1
+        update_job(job_id, progress=progress)
+        await apublish(group, job_id, JobStatuses.RUNNING, module=module.uuid, **progress)
+
+    skipped = []
+    if modules:
+        skipped = async_to_sync(generate_pages_concurrently)(course, modules, on_saved=on_saved)
+
+    publish(group, job_id, JobStatuses.DONE, skipped=skipped, **progress)
+
+    return {"course": course.uuid, "skipped": skipped, **progress}
+
+
+def job_group(job_type, payload):
+    """
+    Channel group that follows a job while it runs, if one exists yet.
+    """
+    if job_type == JobTypes.PAGES:
+        return f"document_{payload['course']}"
+    return None
+
+
+JOB_HANDLERS = {
+    JobTypes.OUTLINE: run_outline_job,
+    JobTypes.PAGES: run_pages_job,
+}
+
+
+def run_job(job_id):
+    job = redis_client.hgetall(job_key(job_id))
+
+    if not job:
+        print(f"Job {job_id} expired before it could run")
+        return
+
+    update_job(job_id, status=JobStatuses.RUNNING, started_at=time.time())
+    payload = json.loads(job["payload"])
+
+    try:
+        result = JOB_HANDLERS[job["type"]](job_id, payload)
+    except Exception as e:
+        print(f"Job {job_id} failed: {e}")
+        update_job(job_id, status=JobStatuses.FAILED, error=str(e), finished_at=time.time())
+
+        group = job_group(job["type"], payload)
+        if group:
+            publish(group, job_id, JobStatuses.FAILED, error=str(e))
+        return
+
+    update_job(job_id, status=JobStatuses.DONE, result=result, finished_at=time.time())
+
+
+def processing_key(worker_id):
+    return f"{JOB_QUEUE}:processing:{worker_id}"
+
+
+def worker_key(worker_id):
+    return f"{JOB_QUEUE}:worker:{worker_id}"
+
+
+def keep_alive(worker_id, stopped):
+    """Refreshes the worker's key, from a thread so long jobs don't let it lapse."""
+    while not stopped.is_set():
+        try:
+            redis_client.set(worker_key(worker_id), time.time(), ex=WORKER_TTL)
+        except Exception as e:
+            print(f"Worker heartbeat failed: {e}")
+        stopped.wait(WORKER_TTL / 3)
+
+
+def reap():
+    """
+    Takes back the jobs of workers that died mid-job: requeued at the
+    front, or failed once they have had MAX_ATTEMPTS runs.
+    """
+    for key in redis_client.scan_iter(processing_key("*")):
+        worker_id = key[len(processing_key("")):]
+        if redis_client.exists(worker_key(worker_id)):
+            continue
+
+        while True:
+            # one job at a time, so two reapers never take the same one
+            job_id = redis_client.rpop(key)
+            if job_id is None:
+                break
+
+            job = redis_client.hgetall(job_key(job_id))
+            if not job:
+                continue
+
+            attempts = redis_client.hincrby(job_key(job_id), "attempts", 1)
+
+            if attempts < MAX_ATTEMPTS:
+                print(f"Requeued job {job_id} from dead worker {worker_id}")
+                update_job(job_id, status=JobStatuses.QUEUED)
+                redis_client.lpush(JOB_QUEUE, job_id)
+                continue
+
+            error = f"Worker {worker_id} died running it {attempts} times"
+            print(f"Job {job_id} failed: {error}")
+            update_job(job_id, status=JobStatuses.FAILED, error=error, finished_at=time.time())
+
+            group = job_group(job["type"], json.loads(job["payload"]))
+            if group:
+                publish(group, job_id, JobStatuses.FAILED, error=error)
+
+
+def work(timeout=5):
+    """
+    Runs jobs one at a time, forever. A job stays in this worker's
+    processing list while it runs, so if the worker dies another one's
+    reap() finds it.
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    processing = processing_key(worker_id)
+    stopped = threading.Event()
+
+    redis_client.set(worker_key(worker_id), time.time(), ex=WORKER_TTL)
+    threading.Thread(target=keep_alive, args=(worker_id, stopped), daemon=True).start()
+
+    try:
+        reap()
+
+        while True:
+            job_id = redis_client.blmove(JOB_QUEUE, processing, timeout, src="LEFT", dest="RIGHT")
+
+            if job_id:
+                run_job(job_id)
+                # only once it ran; an interrupted job is left for reap()
+                redis_client.lrem(processing, 1, job_id)
+            else:
+                reap()
+    finally:
+        stopped.set()
+        redis_client.delete(worker_key(worker_id))
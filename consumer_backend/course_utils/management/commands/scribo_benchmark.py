@@ -0,0 +1,175 @@
+import asyncio
+import json
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.test import APIRequestFactory, force_authenticate
+from authentication.models import AuthProfile
+from organization_utils.models import Member
+from course_utils.models import Course
+from course_utils.routing import websocket_urlpatterns
+from course_utils.serializers import CourseWithModulesSerializer
+from course_utils.stub_scribo_server import stub_outline
+from course_utils.views import CourseView, PageView
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a sorted list."""
+    if not samples:
+        return 0.0
+    index = max(0, math.ceil(pct / 100 * len(samples)) - 1)
+    return samples[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Drives CourseView.post, PageView.post or the outline socket under "
+        "concurrency and reports latency percentiles and throughput. Run it "
+        "against the stub model server (python -m course_utils.stub_scribo_server)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("target", choices=["outline", "pages", "socket"])
+        parser.add_argument("--user", required=True, help="user_name of an owner or admin member.")
+        parser.add_argument("--requests", type=int, default=50)
+        parser.add_argument("--concurrency", type=int, default=10)
+        parser.add_argument("--modules", type=int, default=5, help="Modules per benchmark course.")
+        parser.add_argument("--parallel", action="store_true", help="Use the per-module fan-out in PageView.post.")
+        parser.add_argument("--refresh", action="store_true", help="Bypass the Scribo response cache.")
+        parser.add_argument("--keep", action="store_true", help="Keep the courses the benchmark creates.")
+
+    def handle(self, *args, **options):
+        try:
+            self.member = Member.objects.get(user_name=options["user"])
+            self.user = AuthProfile.objects.get(username=options["user"])
+        except (Member.DoesNotExist, AuthProfile.DoesNotExist):
+            raise CommandError(f"No member with user_name {options['user']}")
+
+        self.options = options
+        self.created = []
+        self.factory = APIRequestFactory()
+
+        try:
+            if options["target"] == "outline":
+                latencies, errors, elapsed = self.run_threads(self.post_outline, range(options["requests"]))
+            elif options["target"] == "pages":
+                courses = [self.create_course(i) for i in range(options["requests"])]
+                latencies, errors, elapsed = self.run_threads(self.post_pages, courses)
+            else:
+                course = self.create_course(0)
+                latencies, errors, elapsed = asyncio.run(self.run_sockets(course))
+        finally:
+            if not options["keep"]:
+                for course in self.created:
+                    course.delete()
+
+        self.report(latencies, errors, elapsed)
+
+    def create_course(self, i):
+        outline = stub_outline(f"Benchmark {i}", "1 hour", self.options["modules"])
+        outline["organization"] = self.member.organization.uuid
+
+        serializer = CourseWithModulesSerializer(data=outline)
+        if not serializer.is_valid():
+            raise CommandError(json.dumps(serializer.errors))
+
+        course = serializer.save()
+        self.created.append(course)
+        return course
+
+    def post_outline(self, i):
+        request = self.factory.post("/api/course/course/", {
+            "topic": f"Benchmark topic {i}",
+            "time": "1 hour",
+            "refresh": self.options["refresh"],
+        }, format="json")
+        force_authenticate(request, user=self.user)
+
+        response = CourseView.as_view()(request)
+
+        if response.status_code == 201:
+            self.created.append(Course.objects.get(uuid=response.data["uuid"]))
+        return response.status_code == 201
+
+    def post_pages(self, course):
+        request = self.factory.post("/api/course/pages/", {
+            "course": course.uuid,
+            "parallel": self.options["parallel"],
+        }, format="json")
+        force_authenticate(request, user=self.user)
+
+        return PageView.as_view()(request).status_code == 201
+
+    def run_threads(self, call, items):
+        def timed(item):
+            started = time.perf_counter()
+            try:
+                ok = call(item)
+            except Exception as e:
+                self.stderr.write(f"Request failed: {e}")
+                ok = False
+            return time.perf_counter() - started, ok
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.options["concurrency"]) as pool:
+            results = list(pool.map(timed, items))
+        elapsed = time.perf_counter() - started
+
+        return [latency for latency, ok in results if ok], sum(not ok for _, ok in results), elapsed
+
+    async def run_sockets(self, course):
+        """Each request is one editor connecting and asking for an outline update."""
+        application = URLRouter(websocket_urlpatterns)
+        semaphore = asyncio.Semaphore(self.options["concurrency"])
+
+        async def update(i):
+            marker = f"<benchmark {i}>"
+
+            async with semaphore:
+                communicator = WebsocketCommunicator(application, f"/ws/outline/{course.uuid}/")
+                connected, _ = await communicator.connect()
+                if not connected:
+                    return None
+
+                await communicator.receive_json_from(timeout=30)
+
+                started = time.perf_counter()
+                await communicator.send_json_to({
+                    "action": "update",
+                    "data": {"comments": marker, "refresh": self.options["refresh"]},
+                })
+
+                try:
+                    # skip broadcasts caused by other editors' updates
+                    while True:
+                        message = await communicator.receive_json_from(timeout=120)
+                        if message.get("status") == "busy":
+                            return None
+                        if marker in json.dumps(message):
+                            return time.perf_counter() - started
+                finally:
+                    await communicator.disconnect()
+
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(update(i) for i in range(self.options["requests"])),
+            return_exceptions=True,
+        )
+        elapsed = time.perf_counter() - started
+
+        latencies = [result for result in results if isinstance(result, float)]
+        return latencies, len(results) - len(latencies), elapsed
+
+    def report(self, latencies, errors, elapsed):
+        latencies = sorted(latencies)
+        completed = len(latencies)
+
+        self.stdout.write(f"target:      {self.options['target']}")
+        self.stdout.write(f"requests:    {completed + errors} ({errors} failed)")
+        self.stdout.write(f"concurrency: {self.options['concurrency']}")
+        self.stdout.write(f"p50:         {percentile(latencies, 50) * 1000:.1f} ms")
+        self.stdout.write(f"p99:         {percentile(latencies, 99) * 1000:.1f} ms")
+        self.stdout.write(f"throughput:  {completed / elapsed if elapsed else 0:.2f} req/s")
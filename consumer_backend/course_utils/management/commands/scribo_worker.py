@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from course_utils.jobs import work
+
+
+class Command(BaseCommand):
+    help = "Runs queued Scribo generation jobs. Start one process per worker."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--timeout",
+            type=int,
+            default=5,
+            help="Seconds to block on the queue before polling again.",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Waiting for generation jobs...")
+        work(timeout=options["timeout"])
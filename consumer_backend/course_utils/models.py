@@ -23,6 +23,7 @@ class Course(Document):
     summary = fields.StringField()
     status = fields.StringField(choices=[e.value for e in StatusEnum], default=StatusEnum.TEMP)
     organization = fields.ReferenceField(Organization, reverse_delete_rule=CASCADE) # refers to owner of the course
+    version = fields.IntField(default=0)  # bumped by every outline save, see CourseWithModulesSerializer.update
 
     def __str__(self):
         return self.uuid
@@ -46,6 +47,7 @@ class Module(Document):
     course = fields.ReferenceField(Course, reverse_delete_rule=CASCADE)  # Ensure proper referencing
     order = fields.IntField()
     content = fields.StringField(default="No data.")
+    version = fields.IntField(default=0)  # outline fields only; content is written behind separately
 
     def __str__(self):
         return self.name
\ No newline at end of file
@@ -0,0 +1,45 @@
+import json
+import redis
+from django.conf import settings
+from .models import Course, Module
+from .redis_pool import redis_client
+
+
+def navigation_key(course_id):
+    return f"nav:{course_id}"
+
+
+def navigation_index(course_id):
+    """
+    The course's uuid and its module uuids in order, keyed by the course's
+    primary key so a module's unfetched course reference is enough to find
+    it. Cached for ``DOCUMENT_EDITING["NAVIGATION_TTL"]`` seconds; saving
+    an outline forgets it.
+    """
+    key = navigation_key(course_id)
+
+    try:
+        cached = redis_client.get(key)
+        if cached:
+            return json.loads(cached)
+    except redis.RedisError as e:
+        print(f"Navigation cache unavailable: {e}")
+
+    index = {
+        "course": Course.objects(pk=course_id).scalar("uuid").first(),
+        "modules": list(Module.objects(course=course_id).order_by("order").scalar("uuid")),
+    }
+
+    try:
+        redis_client.set(key, json.dumps(index), ex=settings.DOCUMENT_EDITING["NAVIGATION_TTL"])
+    except redis.RedisError as e:
+        print(f"Navigation cache unavailable: {e}")
+
+    return index
+
+
+def forget_navigation(course_id):
+    try:
+        redis_client.delete(navigation_key(course_id))
+    except redis.RedisError as e:
+        print(f"Navigation cache unavailable: {e}")
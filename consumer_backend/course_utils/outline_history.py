@@ -0,0 +1,245 @@
+"""
+Edit history of course outlines, for undo, redo and restoring a version.
+
+Every change applied through the outline socket is appended to the stream
+``history:{uuid}`` under the id ``{version}-0``. An entry either holds the
+patch that produced it from its ``base`` version, or a whole outline (the
+first entry, saves, reloads from the db and restores). Every
+``SNAPSHOT_EVERY`` versions the outline is also kept in
+``history:{uuid}:snapshots``, so rebuilding any version replays at most
+that many patches. Past ``MAX_VERSIONS`` the stream is trimmed back to a
+snapshot boundary.
+
+``history:{uuid}:head`` is the version the room is on; undo moves it to the
+head entry's base and redo back, so neither needs the model server.
+"""
+import json
+from django.conf import settings
+from .outline_patch import apply_patch
+from .redis_pool import async_redis
+from .room_cache import OUTLINE_JSON, outline_key
+
+
+class HistoryError(Exception):
+    """The requested version cannot be reached."""
+
+
+def stream_key(course_uuid):
+    return f"history:{course_uuid}"
+
+
+def keys(course_uuid):
+    stream = stream_key(course_uuid)
+    return [stream, f"{stream}:head", f"{stream}:latest", f"{stream}:redo", f"{stream}:snapshots"]
+
+
+# KEYS: stream, head, latest, redo, snapshots, cached outline.
+# ARGV: "patch" or "outline", its json, the resulting outline json or ""
+# to read it from the cached outline when needed, snapshot interval,
+# versions kept, ttl. Returns the new version.
+RECORD = OUTLINE_JSON + """
+local head = redis.call("get", KEYS[2])
+local version = redis.call("incr", KEYS[3])
+local kind, payload = ARGV[1], ARGV[2]
+local every = tonumber(ARGV[4])
+
+local outline = ARGV[3]
+if outline == "" then
+    outline = outline_json(KEYS[6])
+end
+
+-- a patch needs something to apply to, and after an undo its base is
+-- older than the previous entry, so keep the whole outline to leave every
+-- patch chain ending at the snapshot trimming keeps
+if kind == "patch" and tonumber(head) ~= version - 1 and outline then
+    kind, payload = "outline", outline
+end
+
+redis.call("xadd", KEYS[1], version .. "-0", "base", head or "", kind, payload)
+redis.call("set", KEYS[2], version)
+redis.call("del", KEYS[4])
+
+if kind == "patch" and version % every == 0 and outline then
+    redis.call("hset", KEYS[5], version, outline)
+end
+
+local oldest = version - tonumber(ARGV[5]) + 1
+if oldest > every then
+    local keep_from = oldest - (oldest % every)
+    redis.call("xtrim", KEYS[1], "MINID", keep_from .. "-0")
+    for _, snapshot in ipairs(redis.call("hkeys", KEYS[5])) do
+        if tonumber(snapshot) < keep_from then
+            redis.call("hdel", KEYS[5], snapshot)
+        end
+    end
+end
+
+for i = 1, 5 do
+    redis.call("expire", KEYS[i], ARGV[6])
+end
+return version
+"""
+
+# KEYS: stream, head, redo. Moves head to its entry's base; false if
+# there is nothing to undo.
+UNDO = """
+local head = redis.call("get", KEYS[2])
+if not head then
+    return false
+end
+
+local entry = redis.call("xrange", KEYS[1], head .. "-0", head .. "-0")[1]
+if not entry then
+    return false
+end
+
+local base = ""
+for i = 1, #entry[2], 2 do
+    if entry[2][i] == "base" then
+        base = entry[2][i + 1]
+    end
+end
+if base == "" then
+    return false
+end
+
+redis.call("set", KEYS[2], base)
+redis.call("rpush", KEYS[3], head)
+return base
+"""
+
+# KEYS: head, redo. Moves head to the last undone version.
+REDO = """
+local version = redis.call("rpop", KEYS[2])
+if not version then
+    return false
+end
+redis.call("set", KEYS[1], version)
+return version
+"""
+
+
+async def record(course_uuid, outline, patch=None, generation=None):
+    """
+    Appends a version: the patch that produced `outline`, or the whole
+    outline when there is no patch. A patch applied to the cached outline
+    of `generation` can leave `outline` None; the whole outline is then
+    only read when a snapshot needs it. Returns the new version.
+    """
+    stream, head, latest, redo, snapshots = keys(course_uuid)
+    options = settings.OUTLINE_HISTORY
+    script = async_redis().register_script(RECORD)
+
+    outline_json = json.dumps(outline) if outline is not None else ""
+    kind, payload = ("patch", json.dumps(patch)) if patch is not None else ("outline", outline_json)
+
+    return await script(
+        keys=[stream, head, latest, redo, snapshots, outline_key(course_uuid, generation or "")],
+        args=[kind, payload, outline_json, options["SNAPSHOT_EVERY"], options["MAX_VERSIONS"], options["TTL"]],
+    )
+
+
+async def outline_at(course_uuid, version):
+    """Rebuilds the outline as of `version` from the nearest snapshot."""
+    stream, _, _, _, snapshots = keys(course_uuid)
+    client = async_redis()
+    patches = []
+
+    while True:
+        snapshot = await client.hget(snapshots, version)
+        if snapshot:
+            outline = json.loads(snapshot)
+            break
+
+        entries = await client.xrange(stream, f"{version}-0", f"{version}-0")
+        if not entries:
+            raise HistoryError(f"Version {version} is no longer in the history.")
+
+        fields = entries[0][1]
+        if "outline" in fields:
+            outline = json.loads(fields["outline"])
+            break
+
+        patches.append(json.loads(fields["patch"]))
+        version = int(fields["base"])
+
+    for patch in reversed(patches):
+        outline, _ = apply_patch(outline, patch)
+    return outline
+
+
+async def undo(course_uuid):
+    """The version before the current one and its outline."""
+    stream, head, _, redo, _ = keys(course_uuid)
+    script = async_redis().register_script(UNDO)
+
+    version = await script(keys=[stream, head, redo])
+    if not version:
+        raise HistoryError("Nothing to undo.")
+
+    try:
+        return int(version), await outline_at(course_uuid, int(version))
+    except HistoryError:
+        # put head back where it was
+        await async_redis().register_script(REDO)(keys=[head, redo])
+        raise
+
+
+async def redo(course_uuid):
+    """The last undone version and its outline."""
+    _, head, _, redo_key, _ = keys(course_uuid)
+    script = async_redis().register_script(REDO)
+
+    version = await script(keys=[head, redo_key])
+    if not version:
+        raise HistoryError("Nothing to redo.")
+    return int(version), await outline_at(course_uuid, int(version))
+
+
+async def restore(course_uuid, version):
+    """
+    Makes `version` current again by recording it as a new version, so the
+    restore itself can be undone. Returns the new version and the outline.
+    """
+    outline = await outline_at(course_uuid, version)
+    return await record(course_uuid, outline), outline
+
+
+def with_versions(outline, current):
+    """
+    `outline` carrying the course and module versions of `current`, so it
+    saves over `current` without a conflict. Used for outlines from the
+    history, whose stored versions are stale once the room has saved
+    since, and for keeping the room's edits after a conflict. Modules
+    `current` doesn't have are new again.
+    """
+    versions = {module.get("uuid"): module.get("version") for module in current.get("modules") or []}
+    outline = {**outline, "version": current.get("version")}
+    modules = []
+
+    for module in outline.get("modules") or []:
+        module = {key: value for key, value in module.items() if key != "version"}
+        if versions.get(module.get("uuid")) is not None:
+            module["version"] = versions[module["uuid"]]
+        modules.append(module)
+
+    outline["modules"] = modules
+    return outline
+
+
+async def summary(course_uuid):
+    stream, head, latest, redo_key, _ = keys(course_uuid)
+
+    pipe = async_redis().pipeline()
+    pipe.get(head)
+    pipe.get(latest)
+    pipe.xrange(stream, count=1)
+    pipe.llen(redo_key)
+    head_version, latest_version, first, redo_count = await pipe.execute()
+
+    return {
+        "version": int(head_version) if head_version else None,
+        "latest": int(latest_version) if latest_version else None,
+        "oldest": int(first[0][0].split("-")[0]) if first else None,
+        "redo": redo_count,
+    }
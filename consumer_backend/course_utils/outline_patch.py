@@ -0,0 +1,303 @@
+"""
+RFC 6902-style patches for course outlines.
+
+Modules are addressed by uuid instead of position, so an op never depends
+on the ops applied before it by other editors:
+
+    {"op": "replace", "path": "/summary", "value": "..."}
+    {"op": "add", "path": "/modules/-", "value": {...}}           append a module
+    {"op": "add", "path": "/modules/2", "value": {...}}           insert at position 2
+    {"op": "remove", "path": "/modules/<uuid>"}
+    {"op": "replace", "path": "/modules/<uuid>", "value": {...}}
+    {"op": "replace", "path": "/modules/<uuid>/name", "value": "..."}
+    {"op": "move", "from": "/modules/<uuid>", "path": "/modules/0"}
+
+Each op finds its module through a uuid index instead of scanning the
+list, and an OutlineIndex only needs the modules the patch names, so the
+outline socket patches its cached outline in pieces (see
+room_cache.patch_outline): it reads and writes the course fields, the
+module order and the modules the ops touch, never the other modules.
+Applying a patch returns it as it took effect: ops that changed nothing
+are dropped and whole-module replaces are narrowed to the fields that
+differ, making it the minimal diff to broadcast.
+"""
+import uuid
+
+
+class PatchError(Exception):
+    """The patch does not apply to the outline; nothing should be saved."""
+
+
+def escape(segment):
+    return str(segment).replace("~", "~0").replace("/", "~1")
+
+
+def split_path(path):
+    if not isinstance(path, str) or not path.startswith("/"):
+        raise PatchError(f"Invalid path {path!r}")
+    return [segment.replace("~1", "/").replace("~0", "~") for segment in path[1:].split("/")]
+
+
+def index_modules(modules):
+    """Modules by uuid and their order, giving each module without one a uuid."""
+    indexed = {}
+    order = []
+
+    for module in modules:
+        if not isinstance(module, dict):
+            raise PatchError("A module must be an object")
+
+        module = dict(module)
+        module.setdefault("uuid", str(uuid.uuid4()))
+        if not isinstance(module["uuid"], str):
+            raise PatchError(f"Invalid module uuid {module['uuid']!r}")
+        if module["uuid"] in indexed:
+            raise PatchError(f"Module {module['uuid']} appears twice")
+
+        indexed[module["uuid"]] = module
+        order.append(module["uuid"])
+
+    return indexed, order
+
+
+def named_modules(patch):
+    """The uuids of the modules the ops in `patch` address by path."""
+    if not isinstance(patch, list):
+        raise PatchError("A patch must be a list of ops")
+
+    named = set()
+    for op in patch:
+        for key in ("path", "from"):
+            path = op.get(key) if isinstance(op, dict) else None
+            if isinstance(path, str) and path.startswith("/modules/"):
+                named.add(split_path(path)[1])
+    return sorted(named)
+
+
+class OutlineIndex:
+    """
+    An outline as its course fields, its module order and its modules by
+    uuid. Only the modules a patch names need to be there, see
+    named_modules; what the applied ops changed is tracked in `changed`,
+    `removed`, `reordered` and `fields_changed`, so a caller holding the
+    outline in pieces writes back only those.
+    """
+
+    def __init__(self, fields, order, modules):
+        self.outline = dict(fields)
+        self.order = list(order)
+        self.known = set(order)
+        self.modules = {module_uuid: dict(module) for module_uuid, module in modules.items()}
+
+        self.changed = set()
+        self.removed = set()
+        self.reordered = False
+        self.fields_changed = False
+
+    @classmethod
+    def of(cls, outline):
+        modules, order = index_modules(outline.get("modules") or [])
+        return cls({key: value for key, value in outline.items() if key != "modules"}, order, modules)
+
+    def module(self, module_uuid):
+        if module_uuid not in self.known:
+            raise PatchError(f"No module with uuid {module_uuid}")
+        return self.modules[module_uuid]
+
+    def position(self, segment, size):
+        if segment == "-":
+            return size
+        if not segment.isdigit() or int(segment) > size:
+            raise PatchError(f"Invalid module position {segment}")
+        return int(segment)
+
+    def result(self):
+        """The whole outline; needs every module, as built by `of`."""
+        return {**self.outline, "modules": [self.modules[module_uuid] for module_uuid in self.order]}
+
+    def apply_all(self, patch):
+        """Applies every op and returns the ops that took effect."""
+        if not isinstance(patch, list):
+            raise PatchError("A patch must be a list of ops")
+
+        applied = []
+        for op in patch:
+            applied += self.apply(op)
+        return applied
+
+    def apply(self, op):
+        """Applies one op and returns the ops it amounted to."""
+        if not isinstance(op, dict):
+            raise PatchError(f"Invalid op {op!r}")
+
+        kind = op.get("op")
+        segments = split_path(op.get("path"))
+
+        if kind == "move":
+            return self.move(op)
+        if kind not in ("add", "remove", "replace"):
+            raise PatchError(f"Unsupported op {kind!r}")
+        if kind != "remove" and "value" not in op:
+            raise PatchError(f"{kind} needs a value")
+
+        if segments[0] != "modules":
+            if len(segments) != 1 or segments[0] == "uuid":
+                raise PatchError(f"Cannot {kind} {op['path']}")
+            applied = self.set_field(self.outline, kind, segments[0], op.get("value"), "")
+            self.fields_changed |= bool(applied)
+            return applied
+
+        if len(segments) == 1:
+            if kind != "replace" or not isinstance(op["value"], list):
+                raise PatchError("/modules can only be replaced with a list")
+            self.modules, self.order = index_modules(op["value"])
+            self.removed |= self.known - set(self.order)
+            self.known = set(self.order)
+            self.changed = set(self.order)
+            self.reordered = True
+            return [{"op": "replace", "path": "/modules", "value": [self.modules[u] for u in self.order]}]
+
+        target = segments[1]
+
+        if len(segments) == 2:
+            if kind == "add":
+                return self.add_module(target, op["value"])
+            if kind == "remove":
+                return self.remove_module(target)
+            return self.replace_module(target, op["value"])
+
+        if len(segments) == 3 and segments[2] != "uuid":
+            prefix = f"/modules/{escape(target)}"
+            applied = self.set_field(self.module(target), kind, segments[2], op.get("value"), prefix)
+            if applied:
+                self.changed.add(target)
+            return applied
+
+        raise PatchError(f"Cannot {kind} {op['path']}")
+
+    def set_field(self, document, kind, field, value, prefix):
+        path = f"{prefix}/{escape(field)}"
+
+        if kind == "remove":
+            if field not in document:
+                raise PatchError(f"Nothing to remove at {path}")
+            del document[field]
+            return [{"op": "remove", "path": path}]
+
+        if kind == "replace" and field not in document:
+            raise PatchError(f"Nothing to replace at {path}")
+        if field in document and document[field] == value:
+            return []
+
+        document[field] = value
+        return [{"op": kind, "path": path, "value": value}]
+
+    def add_module(self, target, value):
+        if not isinstance(value, dict):
+            raise PatchError("A module must be an object")
+
+        module = dict(value)
+        module.setdefault("uuid", str(uuid.uuid4()))
+        if not isinstance(module["uuid"], str):
+            raise PatchError(f"Invalid module uuid {module['uuid']!r}")
+        if module["uuid"] in self.known:
+            raise PatchError(f"Module {module['uuid']} already exists")
+
+        position = self.position(target, len(self.order))
+        self.modules[module["uuid"]] = module
+        self.order.insert(position, module["uuid"])
+        self.known.add(module["uuid"])
+        self.changed.add(module["uuid"])
+        self.removed.discard(module["uuid"])
+        self.reordered = True
+        return [{"op": "add", "path": f"/modules/{position}", "value": module}]
+
+    def remove_module(self, target):
+        self.module(target)
+        self.modules.pop(target, None)
+        self.order.remove(target)
+        self.known.discard(target)
+        self.changed.discard(target)
+        self.removed.add(target)
+        self.reordered = True
+        return [{"op": "remove", "path": f"/modules/{escape(target)}"}]
+
+    def replace_module(self, target, value):
+        module = self.module(target)
+
+        if not isinstance(value, dict) or value.get("uuid", target) != target:
+            raise PatchError(f"Invalid replacement for module {target}")
+
+        prefix = f"/modules/{escape(target)}"
+        applied = []
+
+        for field in [field for field in module if field not in value and field != "uuid"]:
+            applied += self.set_field(module, "remove", field, None, prefix)
+        for field, field_value in value.items():
+            if field != "uuid":
+                kind = "replace" if field in module else "add"
+                applied += self.set_field(module, kind, field, field_value, prefix)
+        if applied:
+            self.changed.add(target)
+        return applied
+
+    def move(self, op):
+        source = split_path(op.get("from"))
+        target = split_path(op.get("path"))
+
+        if len(source) != 2 or len(target) != 2 or source[0] != "modules" or target[0] != "modules":
+            raise PatchError("Only modules can be moved")
+
+        self.module(source[1])
+        current = self.order.index(source[1])
+        self.order.remove(source[1])
+        position = self.position(target[1], len(self.order))
+        self.order.insert(position, source[1])
+
+        if position == current:
+            return []
+        self.reordered = True
+        return [{"op": "move", "from": f"/modules/{escape(source[1])}", "path": f"/modules/{position}"}]
+
+
+def apply_patch(outline, patch):
+    """
+    Applies the patch to a copy of the outline. Returns the patched outline
+    and the ops that took effect, or raises PatchError, leaving `outline`
+    as it was.
+    """
+    index = OutlineIndex.of(outline)
+    applied = index.apply_all(patch)
+
+    return index.result(), applied
+
+
+def changes_to_patch(original, changes):
+    """
+    Patch for the older change format: Partial<Outline> plus
+    moduleChanges {"add": [Module], "remove": [Module.uuid], "update": [Module]}.
+    Removing or updating an unknown module is ignored, as it always was.
+    """
+    changes = dict(changes or {})
+    module_changes = changes.pop("moduleChanges", None) or {}
+    known = {module.get("uuid") for module in original.get("modules") or []}
+    patch = []
+
+    for module in module_changes.get("add") or []:
+        patch.append({"op": "add", "path": "/modules/-", "value": module})
+        known.add(module.get("uuid"))
+
+    for module_uuid in module_changes.get("remove") or []:
+        if module_uuid in known:
+            patch.append({"op": "remove", "path": f"/modules/{escape(module_uuid)}"})
+            known.discard(module_uuid)
+
+    for module in module_changes.get("update") or []:
+        if module.get("uuid") in known:
+            patch.append({"op": "replace", "path": f"/modules/{escape(module['uuid'])}", "value": module})
+
+    for key in original:
+        if key in changes and key != "uuid":
+            patch.append({"op": "replace", "path": f"/{escape(key)}", "value": changes[key]})
+
+    return patch
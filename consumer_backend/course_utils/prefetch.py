@@ -0,0 +1,49 @@
+"""
+Pages near the one a document room is showing, loaded ahead of navigation.
+
+``page:{room}:prefetch`` is a hash of module uuid -> serialized page. It
+only ever holds the window of ``PREFETCH_DEPTH`` pages either side of the
+current one and expires after ``PREFETCH_TTL``. Anything that rewrites
+module content or the module order outside the room forgets the course's
+entries.
+"""
+import json
+from django.conf import settings
+from .redis_pool import redis_client, async_redis
+
+
+def prefetch_key(room_name):
+    return f"page:{room_name}:prefetch"
+
+
+async def take_prefetched(room_name, module_uuid):
+    """The prefetched page for the module, or None."""
+    cached = await async_redis().hget(prefetch_key(room_name), module_uuid)
+    return json.loads(cached) if cached else None
+
+
+async def remember_prefetched(room_name, pages, window=None):
+    """
+    Stores pages, then drops every entry outside `window` (module uuids)
+    so the hash stays bounded.
+    """
+    key = prefetch_key(room_name)
+    client = async_redis()
+
+    pipe = client.pipeline()
+    for page in pages:
+        page = {name: value for name, value in page.items() if name != "version"}
+        pipe.hset(key, page["currentPage"], json.dumps(page))
+    pipe.expire(key, settings.DOCUMENT_EDITING["PREFETCH_TTL"])
+    pipe.hkeys(key)
+    stored = (await pipe.execute())[-1]
+
+    if window is not None:
+        stale = [uuid for uuid in stored if uuid not in window]
+        if stale:
+            await client.hdel(key, *stale)
+
+
+def forget_prefetched(course_uuid):
+    """Drops a course's prefetched pages; its document room uses the course uuid."""
+    redis_client.delete(prefetch_key(course_uuid))
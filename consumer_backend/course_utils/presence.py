@@ -0,0 +1,114 @@
+"""
+Who is in a document room.
+
+Each connection is a member of ``presence:{room}``, a sorted set of channel
+names scored by their last heartbeat, with the member details alongside in
+``presence:{room}:members``. Members whose heartbeat is older than
+``PRESENCE_TIMEOUT`` count as gone, so a worker that dies without
+disconnecting cannot keep a room alive. The room's shared state is evicted
+only once the last member is gone.
+"""
+import json
+import time
+from django.conf import settings
+from .redis_pool import async_redis
+from .write_behind import DIRTY_KEY
+
+# Adds or refreshes a member, dropping any that stopped heartbeating.
+# KEYS: member set, member details. ARGV: channel, details json, now,
+# timeout. Returns the number of members dropped.
+HEARTBEAT = """
+local stale = redis.call("zrangebyscore", KEYS[1], "-inf", ARGV[3] - ARGV[4])
+for _, channel in ipairs(stale) do
+    redis.call("zrem", KEYS[1], channel)
+    redis.call("hdel", KEYS[2], channel)
+end
+
+redis.call("zadd", KEYS[1], ARGV[3], ARGV[1])
+redis.call("hset", KEYS[2], ARGV[1], ARGV[2])
+
+-- a room nobody heartbeats for cleans itself up
+redis.call("expire", KEYS[1], math.ceil(ARGV[4] * 2))
+redis.call("expire", KEYS[2], math.ceil(ARGV[4] * 2))
+return #stale
+"""
+
+# Removes a member and returns how many live members remain.
+# KEYS: member set, member details. ARGV: channel, now, timeout.
+LEAVE = """
+redis.call("zrem", KEYS[1], ARGV[1])
+redis.call("hdel", KEYS[2], ARGV[1])
+
+for _, channel in ipairs(redis.call("zrangebyscore", KEYS[1], "-inf", ARGV[2] - ARGV[3])) do
+    redis.call("zrem", KEYS[1], channel)
+    redis.call("hdel", KEYS[2], channel)
+end
+return redis.call("zcard", KEYS[1])
+"""
+
+# Deletes the given keys only while the room is still empty, so a member
+# joining during the last one's flush keeps the page, and while it has no
+# unsaved edits, so a failed flush can still be retried.
+# KEYS: member set, dirty hash, then the keys to evict. ARGV: room.
+EVICT_IF_EMPTY = """
+if redis.call("zcard", KEYS[1]) > 0 or redis.call("hexists", KEYS[2], ARGV[1]) == 1 then
+    return 0
+end
+for i = 3, #KEYS do
+    redis.call("del", KEYS[i])
+end
+return 1
+"""
+
+
+def presence_key(room_name):
+    return f"presence:{room_name}"
+
+
+def members_key(room_name):
+    return f"presence:{room_name}:members"
+
+
+async def heartbeat(room_name, channel_name, details):
+    """
+    Marks the channel present with its details. Returns the number of stale
+    members dropped along the way.
+    """
+    script = async_redis().register_script(HEARTBEAT)
+    return await script(
+        keys=[presence_key(room_name), members_key(room_name)],
+        args=[
+            channel_name,
+            json.dumps(details),
+            time.time(),
+            settings.DOCUMENT_EDITING["PRESENCE_TIMEOUT"],
+        ],
+    )
+
+
+async def leave(room_name, channel_name):
+    """Removes the channel and returns how many members are left."""
+    script = async_redis().register_script(LEAVE)
+    return await script(
+        keys=[presence_key(room_name), members_key(room_name)],
+        args=[channel_name, time.time(), settings.DOCUMENT_EDITING["PRESENCE_TIMEOUT"]],
+    )
+
+
+async def evict_if_empty(room_name, *keys):
+    script = async_redis().register_script(EVICT_IF_EMPTY)
+    return bool(await script(keys=[presence_key(room_name), DIRTY_KEY, *keys], args=[room_name]))
+
+
+async def members(room_name):
+    """Live members of the room, earliest to join first."""
+    client = async_redis()
+    cutoff = time.time() - settings.DOCUMENT_EDITING["PRESENCE_TIMEOUT"]
+
+    pipe = client.pipeline()
+    pipe.zrangebyscore(presence_key(room_name), cutoff, "+inf")
+    pipe.hgetall(members_key(room_name))
+    channels, details = await pipe.execute()
+
+    present = [json.loads(details[channel]) for channel in channels if channel in details]
+    return sorted(present, key=lambda member: member["since"])
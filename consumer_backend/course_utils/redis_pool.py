@@ -0,0 +1,34 @@
+import asyncio
+import weakref
+import redis
+import redis.asyncio
+from django.conf import settings
+
+# Shared by the views, the job queue and the Scribo caches so every module
+# in a process reuses one connection pool.
+redis_client = redis.StrictRedis.from_url(
+    settings.CACHES["default"]["LOCATION"],
+    decode_responses=True,
+    max_connections=settings.REDIS_POOL["MAX_CONNECTIONS"],
+)
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def async_redis():
+    """
+    Async client for the running event loop. Asyncio connections cannot
+    cross loops, so each loop gets one client over its own sized pool;
+    under daphne that is a single pool per process.
+    """
+    loop = asyncio.get_running_loop()
+
+    if loop not in _async_clients:
+        pool = redis.asyncio.BlockingConnectionPool.from_url(
+            settings.CACHES["default"]["LOCATION"],
+            decode_responses=True,
+            max_connections=settings.REDIS_POOL["MAX_CONNECTIONS"],
+            timeout=settings.REDIS_POOL["TIMEOUT"],
+        )
+        _async_clients[loop] = redis.asyncio.StrictRedis(connection_pool=pool)
+    return _async_clients[loop]
@@ -0,0 +1,96 @@
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import markdown
+from django.conf import settings
+
+EXTENSIONS = ["fenced_code"]
+
+_local = threading.local()
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_process_pool = None
+
+
+def convert(text):
+    """
+    Converts markdown with this thread's converter, created once and reset
+    between documents instead of rebuilt per call.
+    """
+    md = getattr(_local, "markdown", None)
+
+    if md is None:
+        md = _local.markdown = markdown.Markdown(extensions=EXTENSIONS)
+    else:
+        md.reset()
+
+    return md.convert(text)
+
+
+def process_pool():
+    global _process_pool
+
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=settings.MARKDOWN_RENDERING["PROCESSES"])
+    return _process_pool
+
+
+def content_key(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def cached(key):
+    with _cache_lock:
+        html = _cache.get(key)
+        if html is not None:
+            _cache.move_to_end(key)
+        return html
+
+
+def remember(key, html):
+    with _cache_lock:
+        _cache[key] = html
+        _cache.move_to_end(key)
+
+        while len(_cache) > settings.MARKDOWN_RENDERING["CACHE_ENTRIES"]:
+            _cache.popitem(last=False)
+
+
+def render(text):
+    """
+    HTML for a markdown document, served from a bounded LRU cache keyed by
+    the content hash. Large documents are converted in a process pool.
+    """
+    key = content_key(text)
+    html = cached(key)
+
+    if html is None:
+        if len(text) >= settings.MARKDOWN_RENDERING["PROCESS_POOL_THRESHOLD"]:
+            html = process_pool().submit(convert, text).result()
+        else:
+            html = convert(text)
+        remember(key, html)
+
+    return html
+
+
+async def arender(text):
+    """
+    Same as render() for the consumers: cache hits return immediately and
+    conversions run in a thread or the process pool, off the event loop.
+    """
+    key = content_key(text)
+    html = cached(key)
+
+    if html is None:
+        loop = asyncio.get_running_loop()
+
+        if len(text) >= settings.MARKDOWN_RENDERING["PROCESS_POOL_THRESHOLD"]:
+            html = await loop.run_in_executor(process_pool(), convert, text)
+        else:
+            html = await loop.run_in_executor(None, convert, text)
+        remember(key, html)
+
+    return html
@@ -0,0 +1,351 @@
+"""
+Outline and page state shared by the course sockets, kept coherent with
+writes made outside them.
+
+Outlines are cached under ``outline:{uuid}:{generation}``, as a hash of
+their course fields, their module order and one field per module, so a
+patch reads and writes only the modules it touches. Invalidating a
+course bumps ``course:{uuid}:gen``, so every worker misses at once, and a
+write based on an outline read before the bump lands under the old
+generation where nobody reads it. Outline and page keys expire after
+``ROOM_CACHE`` TTLs; live document rooms refresh their page's TTL with
+each presence heartbeat.
+
+Writers publish on ``INVALIDATION_CHANNEL``. Every worker holds one
+subscription per event loop and tells its own connected consumers, which
+send their clients the fresh state.
+"""
+import asyncio
+import json
+import weakref
+from collections import defaultdict
+import redis
+from django.conf import settings
+from .document_ops import op_log_key
+from .outline_patch import OutlineIndex, index_modules, named_modules
+from .prefetch import forget_prefetched, prefetch_key
+from .redis_pool import redis_client, async_redis
+
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+
+class Scopes:
+    OUTLINE = "outline"
+    PAGES = "pages"
+    DELETED = "deleted"
+
+
+# Sets "content" inside the cached page JSON in a single round-trip. With a
+# second argument it only applies while the page still shows that module.
+# A full replacement bumps the version and drops the edit log, so pending
+# deltas against the old text are rejected and their clients resync.
+SET_PAGE_CONTENT = """
+local page = redis.call("get", KEYS[1])
+if not page then
+    return false
+end
+local data = cjson.decode(page)
+if ARGV[2] and data["currentPage"] ~= ARGV[2] then
+    return false
+end
+data["content"] = ARGV[1]
+data["version"] = (tonumber(data["version"]) or 0) + 1
+page = cjson.encode(data)
+redis.call("set", KEYS[1], page, "KEEPTTL")
+redis.call("del", KEYS[2])
+return page
+"""
+
+# An outline hash holds "course", the json of every outline field but the
+# modules, "order", the json list of module uuids, "module:{uuid}" for each
+# module and "rev", bumped by every write. outline_json(key) puts the
+# whole outline json back together, or returns false if none is cached.
+OUTLINE_JSON = """
+local function outline_json(key)
+    local fields = redis.call("hgetall", key)
+    if #fields == 0 then
+        return false
+    end
+
+    local hash = {}
+    for i = 1, #fields, 2 do
+        hash[fields[i]] = fields[i + 1]
+    end
+
+    local modules = {}
+    for _, module_uuid in ipairs(cjson.decode(hash["order"])) do
+        table.insert(modules, hash["module:" .. module_uuid])
+    end
+
+    local course = hash["course"]
+    local separator = course == "{}" and "" or ","
+    return string.sub(course, 1, -2) .. separator .. '"modules":[' .. table.concat(modules, ",") .. "]}"
+end
+"""
+
+# KEYS: generation counter. ARGV: outline key prefix.
+# Returns the generation and the outline cached for it.
+GET_OUTLINE = OUTLINE_JSON + """
+local generation = redis.call("get", KEYS[1]) or "0"
+return {generation, outline_json(ARGV[1] .. generation)}
+"""
+
+# KEYS: generation counter. ARGV: outline key prefix, then module uuids.
+# Returns the generation, the outline's rev, its course fields, its order
+# and each module asked for; false for what isn't cached.
+GET_OUTLINE_PART = """
+local generation = redis.call("get", KEYS[1]) or "0"
+local key = ARGV[1] .. generation
+local part = {
+    generation,
+    redis.call("hget", key, "rev") or "0",
+    redis.call("hget", key, "course"),
+    redis.call("hget", key, "order"),
+}
+for i = 2, #ARGV do
+    table.insert(part, redis.call("hget", key, "module:" .. ARGV[i]))
+end
+return part
+"""
+
+# KEYS: outline. ARGV: "1" to only set while none is cached, ttl, then
+# field/value pairs. Replaces the whole hash; returns 1 if it did.
+SET_OUTLINE = """
+if ARGV[1] == "1" and redis.call("exists", KEYS[1]) == 1 then
+    return 0
+end
+local rev = tonumber(redis.call("hget", KEYS[1], "rev") or "0")
+redis.call("del", KEYS[1])
+for i = 3, #ARGV, 2 do
+    redis.call("hset", KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call("hset", KEYS[1], "rev", rev + 1)
+redis.call("expire", KEYS[1], ARGV[2])
+return 1
+"""
+
+# KEYS: outline. ARGV: the rev the changes were made on, ttl, the number
+# of fields to delete, those fields, then field/value pairs to set.
+# Writes only while the outline is still at that rev; returns 1 if it did.
+WRITE_OUTLINE_PART = """
+if redis.call("hget", KEYS[1], "rev") ~= ARGV[1] then
+    return 0
+end
+local deleted = tonumber(ARGV[3])
+for i = 4, 3 + deleted do
+    redis.call("hdel", KEYS[1], ARGV[i])
+end
+for i = 4 + deleted, #ARGV, 2 do
+    redis.call("hset", KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call("hincrby", KEYS[1], "rev", 1)
+redis.call("expire", KEYS[1], ARGV[2])
+return 1
+"""
+
+
+def page_key(room_name):
+    return f"page:{room_name}"
+
+
+def generation_key(course_uuid):
+    return f"course:{course_uuid}:gen"
+
+
+def outline_key(course_uuid, generation):
+    return f"outline:{course_uuid}:{generation}"
+
+
+async def get_outline(course_uuid):
+    """The current generation and its cached outline, or {} on a miss."""
+    script = async_redis().register_script(GET_OUTLINE)
+    generation, outline = await script(
+        keys=[generation_key(course_uuid)], args=[outline_key(course_uuid, "")]
+    )
+    return generation, json.loads(outline) if outline else {}
+
+
+def module_field(module_uuid):
+    return f"module:{module_uuid}"
+
+
+async def set_outline(course_uuid, generation, outline, nx=False):
+    """
+    Caches an outline read or derived from `generation`. With `nx` only
+    while none is cached, returning whether this call stored it.
+    """
+    modules, order = index_modules(outline.get("modules") or [])
+    fields = {key: value for key, value in outline.items() if key != "modules"}
+
+    pairs = ["course", json.dumps(fields), "order", json.dumps(order)]
+    for module_uuid, module in modules.items():
+        pairs += [module_field(module_uuid), json.dumps(module)]
+
+    script = async_redis().register_script(SET_OUTLINE)
+    stored = await script(
+        keys=[outline_key(course_uuid, generation)],
+        args=["1" if nx else "0", settings.ROOM_CACHE["OUTLINE_TTL"], *pairs],
+    )
+    return bool(stored)
+
+
+async def patch_outline(course_uuid, patch):
+    """
+    Applies an outline patch to the cached outline, reading and writing
+    only its course fields, its module order and the modules the patch
+    names. Returns the generation patched and the ops that took effect,
+    None if no outline is cached, or raises PatchError and writes nothing.
+    A patch that lost a race with another write is applied again on top.
+    """
+    named = named_modules(patch)
+    client = async_redis()
+    read = client.register_script(GET_OUTLINE_PART)
+    write = client.register_script(WRITE_OUTLINE_PART)
+
+    while True:
+        generation, rev, fields, order, *modules = await read(
+            keys=[generation_key(course_uuid)], args=[outline_key(course_uuid, ""), *named]
+        )
+        if fields is None:
+            return None
+
+        index = OutlineIndex(
+            json.loads(fields),
+            json.loads(order),
+            {module_uuid: json.loads(module) for module_uuid, module in zip(named, modules) if module},
+        )
+        applied = index.apply_all(patch)
+        if not applied:
+            return generation, applied
+
+        deleted = [module_field(module_uuid) for module_uuid in index.removed]
+        pairs = []
+        if index.fields_changed:
+            pairs += ["course", json.dumps(index.outline)]
+        if index.reordered:
+            pairs += ["order", json.dumps(index.order)]
+        for module_uuid in index.changed:
+            pairs += [module_field(module_uuid), json.dumps(index.modules[module_uuid])]
+
+        written = await write(
+            keys=[outline_key(course_uuid, generation)],
+            args=[rev, settings.ROOM_CACHE["OUTLINE_TTL"], len(deleted), *deleted, *pairs],
+        )
+        if written:
+            return generation, applied
+
+
+async def refresh_page_ttl(room_name):
+    pipe = async_redis().pipeline()
+    pipe.expire(page_key(room_name), settings.ROOM_CACHE["PAGE_TTL"])
+    pipe.expire(op_log_key(room_name), settings.ROOM_CACHE["PAGE_TTL"])
+    await pipe.execute()
+
+
+def publish(course_uuid, scope):
+    try:
+        redis_client.publish(INVALIDATION_CHANNEL, json.dumps({"course": course_uuid, "scope": scope}))
+    except redis.RedisError as e:
+        # the TTLs still bound how long anything stays stale
+        print(f"Cache invalidation for {course_uuid} not published: {e}")
+
+
+def invalidate_outline(course_uuid):
+    """Call after changing a course or its modules outside the outline socket."""
+    try:
+        redis_client.incr(generation_key(course_uuid))
+    except redis.RedisError as e:
+        print(f"Outline cache for {course_uuid} not invalidated: {e}")
+
+    publish(course_uuid, Scopes.OUTLINE)
+
+
+def invalidate_pages(course_uuid, contents):
+    """
+    Call after writing module content outside the document socket, with
+    the new content by module uuid. A room showing one of the modules has
+    its page replaced; prefetched pages are dropped.
+    """
+    try:
+        script = redis_client.register_script(SET_PAGE_CONTENT)
+        for module_uuid, content in contents.items():
+            script(keys=[page_key(course_uuid), op_log_key(course_uuid)], args=[content, module_uuid])
+        forget_prefetched(course_uuid)
+    except redis.RedisError as e:
+        print(f"Page cache for {course_uuid} not invalidated: {e}")
+
+    publish(course_uuid, Scopes.PAGES)
+
+
+def invalidate_course(course_uuid):
+    """Call after deleting a course."""
+    try:
+        pipe = redis_client.pipeline()
+        pipe.incr(generation_key(course_uuid))
+        pipe.delete(page_key(course_uuid), op_log_key(course_uuid), prefetch_key(course_uuid))
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Caches for {course_uuid} not invalidated: {e}")
+
+    publish(course_uuid, Scopes.DELETED)
+
+
+class InvalidationListener:
+    """
+    This worker's subscription to the invalidation channel. Consumers
+    register under their group name and get ``cache_invalidated(event)``
+    for their course.
+    """
+
+    def __init__(self):
+        self.rooms = defaultdict(weakref.WeakSet)
+        self.task = None
+
+    def register(self, group, consumer):
+        self.rooms[group].add(consumer)
+
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.listen())
+
+    def unregister(self, group, consumer):
+        self.rooms[group].discard(consumer)
+        if not self.rooms[group]:
+            del self.rooms[group]
+
+    async def listen(self):
+        while True:
+            pubsub = async_redis().pubsub()
+
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.notify(json.loads(message["data"]))
+            except redis.RedisError as e:
+                print(f"Cache invalidation subscription lost, resubscribing: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    def notify(self, event):
+        groups = {
+            Scopes.OUTLINE: [f"course_{event['course']}"],
+            Scopes.PAGES: [f"document_{event['course']}"],
+            Scopes.DELETED: [f"course_{event['course']}", f"document_{event['course']}"],
+        }.get(event.get("scope"), [])
+
+        for group in groups:
+            for consumer in list(self.rooms.get(group, ())):
+                asyncio.ensure_future(consumer.cache_invalidated(event))
+
+
+_listeners = weakref.WeakKeyDictionary()
+
+
+def invalidation_listener():
+    loop = asyncio.get_running_loop()
+
+    if loop not in _listeners:
+        _listeners[loop] = InvalidationListener()
+    return _listeners[loop]
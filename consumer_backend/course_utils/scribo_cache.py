@@ -0,0 +1,141 @@
+import hashlib
+import json
+import time
+import redis
+from django.conf import settings
+from .redis_pool import redis_client, async_redis
+
+CACHE_PREFIX = "scribo:cache:"
+LRU_KEY = "scribo:cache:lru"  # sorted set of cache keys scored by last access
+STATS_KEY = "scribo:cache:stats"
+
+
+def normalize(value):
+    """
+    Canonical form of a payload: keys sorted, strings trimmed with their
+    whitespace collapsed, so cosmetic differences share a cache entry.
+    """
+    if isinstance(value, dict):
+        return {key: normalize(value[key]) for key in sorted(value)}
+    if isinstance(value, (list, tuple)):
+        return [normalize(item) for item in value]
+    if isinstance(value, str):
+        return " ".join(value.split())
+    return value
+
+
+def cache_key(endpoint, payload):
+    canonical = json.dumps(normalize(payload), sort_keys=True, separators=(",", ":"))
+    digest = hashlib.sha256(f"{endpoint}\n{canonical}".encode()).hexdigest()
+    return CACHE_PREFIX + digest
+
+
+class ScriboCache:
+    """
+    Redis cache for model server responses with a TTL, least recently used
+    eviction past ``SCRIBO["CACHE_MAX_ENTRIES"]`` and hit/miss counters.
+
+    Redis errors are treated as misses so the cache can never fail a request.
+    """
+
+    def __init__(self, client=redis_client):
+        self.client = client
+        self.ttl = settings.SCRIBO["CACHE_TTL"]
+        self.max_entries = settings.SCRIBO["CACHE_MAX_ENTRIES"]
+
+    def get(self, key):
+        try:
+            cached = self.client.get(key)
+
+            pipe = self.client.pipeline()
+            if cached is None:
+                pipe.hincrby(STATS_KEY, "misses", 1)
+            else:
+                pipe.hincrby(STATS_KEY, "hits", 1)
+                pipe.zadd(LRU_KEY, {key: time.time()})
+            pipe.execute()
+        except redis.RedisError as e:
+            print(f"Scribo cache unavailable: {e}")
+            return None
+
+        return json.loads(cached) if cached is not None else None
+
+    def set(self, key, value):
+        try:
+            pipe = self.client.pipeline()
+            pipe.set(key, json.dumps(value), ex=self.ttl)
+            pipe.zadd(LRU_KEY, {key: time.time()})
+            pipe.zcard(LRU_KEY)
+            size = pipe.execute()[-1]
+
+            if size > self.max_entries:
+                self.evict(size - self.max_entries)
+        except redis.RedisError as e:
+            print(f"Scribo cache unavailable: {e}")
+
+    def evict(self, count):
+        evicted = [key for key, _ in self.client.zpopmin(LRU_KEY, count)]
+
+        if evicted:
+            pipe = self.client.pipeline()
+            pipe.delete(*evicted)
+            pipe.hincrby(STATS_KEY, "evictions", len(evicted))
+            pipe.execute()
+
+    def stats(self):
+        stats = {"hits": 0, "misses": 0, "evictions": 0}
+        stats.update({key: int(value) for key, value in self.client.hgetall(STATS_KEY).items()})
+        stats["entries"] = self.client.zcard(LRU_KEY)
+        return stats
+
+
+class AsyncScriboCache(ScriboCache):
+    """Same cache for the consumers, on the async Redis client."""
+
+    def __init__(self, client=None):
+        super().__init__(client or async_redis())
+
+    async def get(self, key):
+        try:
+            cached = await self.client.get(key)
+
+            pipe = self.client.pipeline()
+            if cached is None:
+                pipe.hincrby(STATS_KEY, "misses", 1)
+            else:
+                pipe.hincrby(STATS_KEY, "hits", 1)
+                pipe.zadd(LRU_KEY, {key: time.time()})
+            await pipe.execute()
+        except redis.RedisError as e:
+            print(f"Scribo cache unavailable: {e}")
+            return None
+
+        return json.loads(cached) if cached is not None else None
+
+    async def set(self, key, value):
+        try:
+            pipe = self.client.pipeline()
+            pipe.set(key, json.dumps(value), ex=self.ttl)
+            pipe.zadd(LRU_KEY, {key: time.time()})
+            pipe.zcard(LRU_KEY)
+            size = (await pipe.execute())[-1]
+
+            if size > self.max_entries:
+                await self.evict(size - self.max_entries)
+        except redis.RedisError as e:
+            print(f"Scribo cache unavailable: {e}")
+
+    async def evict(self, count):
+        evicted = [key for key, _ in await self.client.zpopmin(LRU_KEY, count)]
+
+        if evicted:
+            pipe = self.client.pipeline()
+            pipe.delete(*evicted)
+            pipe.hincrby(STATS_KEY, "evictions", len(evicted))
+            await pipe.execute()
+
+    async def stats(self):
+        stats = {"hits": 0, "misses": 0, "evictions": 0}
+        stats.update({key: int(value) for key, value in (await self.client.hgetall(STATS_KEY)).items()})
+        stats["entries"] = await self.client.zcard(LRU_KEY)
+        return stats
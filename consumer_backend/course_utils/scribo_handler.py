@@ -1,59 +1,276 @@
-import os
-import requests
+import asyncio
+import contextlib
 import json
+import threading
+import weakref
+import httpx
+from django.conf import settings
+from .circuit_breaker import guard
+from .scribo_cache import ScriboCache, AsyncScriboCache, cache_key
+from .single_flight import SingleFlight
+
+GENERATE_PAGE = "/generate-module-content"
+GENERATE_OUTLINE = "/generate-outline"
+UPDATE_OUTLINE = "/update-outline"
+
+
+def _timeout(endpoint):
+    """Read timeout for an endpoint, with a shared connect timeout."""
+    config = settings.SCRIBO
+    read_timeout = config["TIMEOUTS"].get(endpoint, config["DEFAULT_TIMEOUT"])
+    return httpx.Timeout(read_timeout, connect=config["CONNECT_TIMEOUT"])
+
+
+def _slow_after(endpoint):
+    """Calls taking over half their timeout shrink the concurrency limit."""
+    return _timeout(endpoint).read / 2
+
+
+def _limits():
+    """Keep-alive pool limits shared by the sync and async clients."""
+    config = settings.SCRIBO
+    return httpx.Limits(
+        max_connections=config["MAX_CONNECTIONS"],
+        max_keepalive_connections=config["MAX_KEEPALIVE_CONNECTIONS"],
+        keepalive_expiry=config["KEEPALIVE_EXPIRY"],
+    )
+
+
+class BaseScriboHandler():
+    """Request validation and response parsing shared by both handlers."""
 
-class ScriboHandler():
     def __init__(self):
-        self.api_address = os.environ.get('REACT_APP_HUGGINGFACE_ADDRESS')
+        self.api_address = settings.SCRIBO["ADDRESS"]
 
-    def generate_page(self, data):
-        url = self.api_address + '/generate-module-content'
-        data2 = data
-        print(data2)
-        response = requests.post(url, json=data2)
+    def url(self, endpoint):
+        return self.api_address + endpoint
 
-        if response.status_code == 200:
-            response_json = response.json()
-            content = response_json.get('response',{})
-            print(content)
-            return content
-        else:
-            return "ERROR"
-
-    def generate_course_outline(self, data):
+    def page_request(self, title, modules):
+        """Body for /generate-module-content covering the given modules."""
+        return {
+            "title": title,
+            "modules": [
+                {
+                    "name": module.name,
+                    "duration": module.duration,
+                    "subtopics": list(module.subtopics),
+                }
+                for module in modules
+            ],
+        }
+
+    def validate_outline_request(self, data):
         if data.get('topic') is None:
             raise Exception('No topic provided')
         if data.get('time') is None:
             raise Exception('No duration provided')
-        
-        url = self.api_address + '/generate-outline'
-        
-        response = requests.post(url, json=data)
 
+    def validate_update_request(self, data):
+        if data.get('script') is None:
+            raise Exception('No script provided.')
+        if data.get('notes') is None:
+            raise Exception('No notes are provided')
+
+    def check_response(self, response, outcome):
+        """5xx responses count against the model server."""
+        if response.status_code >= 500:
+            outcome.failed = True
+        return response
+
+    def parse_page(self, response):
+        if response.status_code == 200:
+            return response.json().get('response', {})
+        return "ERROR"
+
+    def parse_outline(self, response):
         data = response.json()
 
-        course_outline = data.get("response").get("output_validator").get("valid_replies")
+        course_outline = data.get("response", {}).get("output_validator", {}).get("valid_replies", [])
 
         return json.loads(course_outline)
-    
-    def update_course_outline(self, data):
+
+
+class ScriboHandler(BaseScriboHandler):
+    """Blocking client for the REST views.
+
+    All instances share one keep-alive pool. Every call goes through the
+    circuit breaker and adaptive limiter, raising ScriboBusyError instead
+    of queueing when the model server is down or saturated.
+    """
+    _client = None
+    _client_lock = threading.Lock()
+
+    @classmethod
+    def client(cls):
+        with cls._client_lock:
+            if cls._client is None:
+                cls._client = httpx.Client(limits=_limits())
+        return cls._client
+
+    def post(self, endpoint, data):
+        client = self.client()
+        with guard(slow_after=_slow_after(endpoint)) as outcome:
+            response = client.post(self.url(endpoint), json=data, timeout=_timeout(endpoint))
+            return self.check_response(response, outcome)
+
+    def cached_outline(self, endpoint, data, use_cache):
+        """Outline for a payload, from the cache unless `use_cache` is False.
+
+        Bypassed requests still refresh the cached entry.
+        """
+        cache = ScriboCache()
+        key = cache_key(endpoint, data)
+
+        if use_cache:
+            course_outline = cache.get(key)
+            if course_outline is not None:
+                return course_outline
+
+        course_outline = self.parse_outline(self.post(endpoint, data))
+        cache.set(key, course_outline)
+
+        return course_outline
+
+    def generate_page(self, data):
+        return self.parse_page(self.post(GENERATE_PAGE, data))
+
+    def generate_course_outline(self, data, use_cache=True):
+        self.validate_outline_request(data)
+
+        return self.cached_outline(GENERATE_OUTLINE, data, use_cache)
+
+    def update_course_outline(self, data, use_cache=True):
         """Body:
 
         {
             script: string,
             comments: string
         }"""
-        if data.get('script') is None:
-            raise Exception('No script provided.')
-        if data.get('notes') is None:
-            raise Exception('No notes are provided')
-        
-        url = self.api_address + '/update-outline'
-        
-        response = requests.post(url, json=data)
+        self.validate_update_request(data)
 
-        data = response.json()
+        return self.cached_outline(UPDATE_OUTLINE, data, use_cache)
 
-        course_outline = data.get("response",  {}).get("output_validator", {}).get("valid_replies", [])
 
-        return json.loads(course_outline)
+class AsyncScriboHandler(BaseScriboHandler):
+    """Non-blocking client for the websocket consumers.
+
+    Each event loop gets its own pooled ``httpx.AsyncClient``, so awaiting
+    the model server never blocks other sockets on the worker. Calls share
+    the process-wide circuit breaker and adaptive limiter with ScriboHandler.
+    Code reached through async_to_sync runs on a loop of its own that ends
+    with the call, so it wraps its calls in ``scoped()`` to close the client.
+    """
+    _clients = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def client(cls):
+        loop = asyncio.get_running_loop()
+
+        if loop not in cls._clients:
+            cls._clients[loop] = httpx.AsyncClient(limits=_limits())
+        return cls._clients[loop]
+
+    @classmethod
+    @contextlib.asynccontextmanager
+    async def scoped(cls):
+        """
+        Gives this loop a client that is closed on leaving. A loop that
+        already has one, like a consumer's, keeps it open.
+        """
+        loop = asyncio.get_running_loop()
+
+        if loop in cls._clients:
+            yield cls._clients[loop]
+            return
+
+        async with httpx.AsyncClient(limits=_limits()) as client:
+            cls._clients[loop] = client
+            try:
+                yield client
+            finally:
+                cls._clients.pop(loop, None)
+
+    async def post(self, endpoint, data):
+        client = self.client()
+        with guard(slow_after=_slow_after(endpoint)) as outcome:
+            response = await client.post(self.url(endpoint), json=data, timeout=_timeout(endpoint))
+            return self.check_response(response, outcome)
+
+    async def generate_page(self, data):
+        return self.parse_page(await self.post(GENERATE_PAGE, data))
+
+    async def stream_page(self, data):
+        """Yields module content as the model server produces it.
+
+        The request is sent with ``stream: true``. Server-sent events are
+        read from their ``data:`` lines (JSON carrying ``token`` or
+        ``response``, or plain text) until ``[DONE]``; any other chunked
+        response is relayed as raw text.
+        """
+        client = self.client()
+        with guard() as outcome:
+            async with client.stream(
+                "POST",
+                self.url(GENERATE_PAGE),
+                json={**data, "stream": True},
+                timeout=_timeout(GENERATE_PAGE),
+            ) as response:
+                self.check_response(response, outcome)
+                response.raise_for_status()
+
+                if not response.headers.get("content-type", "").startswith("text/event-stream"):
+                    async for chunk in response.aiter_text():
+                        yield chunk
+                    return
+
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+
+                    payload = line[len("data:"):]
+                    if payload.startswith(" "):
+                        payload = payload[1:]
+                    if payload.strip() == "[DONE]":
+                        return
+
+                    try:
+                        event = json.loads(payload)
+                    except ValueError:
+                        yield payload
+                        continue
+
+                    if isinstance(event, dict):
+                        yield event.get("token", event.get("response", ""))
+                    else:
+                        yield str(event)
+
+    async def cached_outline(self, endpoint, data, use_cache):
+        """Outline for a payload, from the cache unless `use_cache` is False.
+
+        Misses go through a single-flight layer, so identical requests from
+        several editors share one model call.
+        """
+        cache = AsyncScriboCache()
+        key = cache_key(endpoint, data)
+
+        if use_cache:
+            course_outline = await cache.get(key)
+            if course_outline is not None:
+                return course_outline
+
+        async def fetch():
+            course_outline = self.parse_outline(await self.post(endpoint, data))
+            await cache.set(key, course_outline)
+            return course_outline
+
+        return await SingleFlight().do(key, fetch, lock_ttl=_timeout(endpoint).read)
+
+    async def generate_course_outline(self, data, use_cache=True):
+        self.validate_outline_request(data)
+
+        return await self.cached_outline(GENERATE_OUTLINE, data, use_cache)
+
+    async def update_course_outline(self, data, use_cache=True):
+        self.validate_update_request(data)
+
+        return await self.cached_outline(UPDATE_OUTLINE, data, use_cache)
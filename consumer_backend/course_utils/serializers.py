@@ -1,8 +1,168 @@
+from bson import DBRef
+from redis.exceptions import LockError
+from mongoengine.queryset import QuerySet
+from mongoengine.queryset.visitor import Q
+from pymongo import DeleteMany, InsertOne, UpdateOne
 from rest_framework_mongoengine.serializers import serializers, DocumentSerializer
 from .models import Course, Module, StatusEnum
 from organization_utils.models import Organization
 from django.forms import ValidationError
 from rest_framework import serializers as rf_serializers
+from .navigation import forget_navigation, navigation_index
+from .redis_pool import redis_client
+
+# Outline saves of a course take turns; a save holds the lock this long at most
+SAVE_LOCK_TIMEOUT = 30
+# and waits this long for another save of the course to finish
+SAVE_LOCK_WAIT = 10
+
+class VersionConflict(Exception):
+    """A save was based on an older version of a course or module than the stored one."""
+
+    def __init__(self, document, version):
+        super().__init__(f"{type(document).__name__} {document.uuid} is at version {version}.")
+        self.document = document
+        self.version = version
+
+
+def reference_id(value):
+    """Primary key behind a reference field value, without dereferencing it."""
+    if isinstance(value, DBRef):
+        return value.id
+    return getattr(value, "pk", value)
+
+
+def changed_fields(instance, data, fields):
+    """The fields in `data` whose value differs from the stored one."""
+    changes = {}
+
+    for field in fields:
+        if field not in data:
+            continue
+
+        current = instance._data.get(field)
+        value = data[field]
+
+        if field == "organization":
+            current, value = reference_id(current), reference_id(value)
+        if current != value:
+            changes[field] = data[field]
+
+    return changes
+
+
+def compare_and_set(instance, changes):
+    """
+    Writes `changes` with a single update_one that only matches while the
+    document is still at the version it was read at, and bumps the version.
+    """
+    version = instance.version or 0
+    # documents saved before versioning have no version field yet
+    matches_version = Q(version=version) | Q(version__exists=False) if version == 0 else Q(version=version)
+
+    updated = type(instance).objects(Q(pk=instance.pk) & matches_version).update_one(
+        inc__version=1, **{f"set__{field}": value for field, value in changes.items()}
+    )
+
+    if not updated:
+        current = type(instance).objects(pk=instance.pk).scalar("version").first()
+        raise VersionConflict(instance, current or 0)
+
+    for field, value in changes.items():
+        setattr(instance, field, value)
+    instance.version = version + 1
+
+
+def version_filter(version):
+    """Raw query matching a document still at `version`."""
+    if version == 0:
+        # documents saved before versioning have no version field yet
+        return {"$or": [{"version": 0}, {"version": {"$exists": False}}]}
+    return {"version": version}
+
+
+def write_modules(course, inserts=(), updates=(), removed=()):
+    """
+    Persists a course's module changes in one unordered bulk_write.
+
+    `inserts` are unsaved Module documents, `updates` (module, changes)
+    pairs written compare-and-set like compare_and_set, and `removed` the
+    uuids to delete. Raises VersionConflict if an update found its module
+    at another version; the rest of the batch is still written, so an
+    outline save checks every version under save_lock first.
+    """
+    requests = [InsertOne(module.to_mongo()) for module in inserts]
+
+    for module, changes in updates:
+        values = {field: Module._fields[field].to_mongo(value) for field, value in changes.items()}
+        requests.append(UpdateOne(
+            {"_id": module.pk, **version_filter(module.version or 0)},
+            {"$set": values, "$inc": {"version": 1}},
+        ))
+
+    if removed:
+        requests.append(DeleteMany({"course": course.pk, "uuid": {"$in": list(removed)}}))
+
+    if not requests:
+        return
+
+    result = Module._get_collection().bulk_write(requests, ordered=False)
+
+    if result.matched_count < len(updates):
+        stored = dict(Module.objects(pk__in=[module.pk for module, _ in updates]).scalar("id", "version"))
+
+        for module, _ in updates:
+            if (stored.get(module.pk) or 0) != (module.version or 0) + 1:
+                raise VersionConflict(module, stored.get(module.pk) or 0)
+
+    for module, changes in updates:
+        for field, value in changes.items():
+            setattr(module, field, value)
+        module.version = (module.version or 0) + 1
+
+
+def save_lock(course):
+    """
+    Lock a course's outline saves take turns on. The standalone Mongo has
+    no multi-document transactions, so a save checks every version and
+    writes under it, and another save can't move a version in between.
+    """
+    return redis_client.lock(f"saving:{course.uuid}", timeout=SAVE_LOCK_TIMEOUT, blocking_timeout=SAVE_LOCK_WAIT)
+
+
+def modules_by_course(course_ids):
+    """
+    The modules of every given course in order, keyed by course primary
+    key, fetched with one $in query.
+    """
+    grouped = {course_id: [] for course_id in course_ids}
+
+    if not grouped:
+        return grouped
+
+    for module in Module.objects(course__in=list(grouped)).no_dereference().order_by("order"):
+        grouped[reference_id(module.course)].append(module)
+
+    return grouped
+
+
+class CourseListSerializer(rf_serializers.ListSerializer):
+    """
+    Serializes a list of courses in a fixed number of queries: one for the
+    courses, one for their organizations and one for all their modules,
+    instead of two per course.
+    """
+    def to_representation(self, data):
+        if isinstance(data, QuerySet):
+            # dereferences every course's organization in one query
+            courses = data.select_related()
+        else:
+            courses = list(data)
+
+        self.context["modules"] = modules_by_course([course.pk for course in courses])
+
+        return super().to_representation(courses)
+
 
 class BaseSerializer(DocumentSerializer):
     """ Base Serializer that over rights the update and validate functions
@@ -29,10 +189,11 @@ class CourseSerializer(BaseSerializer):
     uuid = serializers.CharField(required=False)
     status = serializers.CharField(required=False, allow_null=True)
     organization = serializers.CharField(max_length=24, allow_null=True)
+    version = serializers.IntegerField(read_only=True)
  
     class Meta:
         model = Course
-        fields = ['uuid', 'title', 'objectives', 'duration', 'summary', 'status', 'organization']  # Added `uuid`
+        fields = ['uuid', 'title', 'objectives', 'duration', 'summary', 'status', 'organization', 'version']  # Added `uuid`
 
     def create(self, validated_data):
         """
@@ -64,10 +225,11 @@ class ModuleSerializer(BaseSerializer):
     uuid = serializers.CharField(required=False)
     course_uuid = serializers.CharField(write_only=True, required=False)  # Allow input but don't include in response
     order = serializers.IntegerField(write_only=True, required=False)
+    version = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Module
-        fields = ['uuid', 'name', 'duration', 'subtopics', 'features', 'course_uuid', 'order']
+        fields = ['uuid', 'name', 'duration', 'subtopics', 'features', 'course_uuid', 'order', 'version']
 
     # def to_internal_value(self, data):
     #     """
@@ -105,19 +267,32 @@ class CourseWithModulesSerializer(CourseSerializer):
 
     class Meta(CourseSerializer.Meta):
         fields = CourseSerializer.Meta.fields + ['modules']
+        list_serializer_class = CourseListSerializer
+
+    # Fields an outline save may change
+    COURSE_FIELDS = ['title', 'objectives', 'duration', 'summary', 'status', 'organization']
+    MODULE_FIELDS = ['name', 'duration', 'subtopics', 'features', 'order']
 
 
+    def new_module(self, course, module_data, order, keep_uuid=False):
+        """An unsaved, validated module for a bulk insert."""
+        fields = {field: module_data[field] for field in self.MODULE_FIELDS if field in module_data}
+        if keep_uuid and module_data.get("uuid"):
+            fields["uuid"] = module_data["uuid"]
+        module = Module(**{**fields, "course": course, "order": order})
+        module.validate()
+        return module
+
     def create(self, validated_data):
         """
-        Create the course and all its modules.
+        Create the course and all its modules, the modules in one bulk write.
         """
         modules_data = validated_data.pop('modules', [])
         course = super().create(validated_data)
 
-        for i, module_data in enumerate(modules_data):
-            module_data['course_uuid'] = course.uuid
-            module_data['order'] = i
-            ModuleSerializer(context=self.context).create(module_data)
+        write_modules(course, inserts=[
+            self.new_module(course, module_data, i, keep_uuid=True) for i, module_data in enumerate(modules_data)
+        ])
 
         return course
     
@@ -125,6 +300,14 @@ class CourseWithModulesSerializer(CourseSerializer):
         """
         Update the course and all its modules.
         If a module is not included in the request, it will be deleted.
+
+        Each course or module carrying a "version" must still be at that
+        version, or VersionConflict is raised before anything is written;
+        saves of one course take turns under save_lock so no other save
+        moves a version between the check and the writes. Only changed
+        fields are written, compare-and-set; unchanged modules are skipped
+        entirely. Module inserts, updates, reorders and deletes go to the
+        database as one bulk write, the course after it.
         """
         modules_data = validated_data.pop('modules', [])
 
@@ -136,46 +319,91 @@ class CourseWithModulesSerializer(CourseSerializer):
                     validated_data["organization"] = Organization.objects.get(uuid=org_id)
                 except Organization.DoesNotExist:
                     raise serializers.ValidationError("Invalid organization reference.")
-                
 
-        course = super().update(instance, validated_data)
+        course = instance
+
+        lock = save_lock(course)
+        if not lock.acquire():
+            # another save kept the course too long, this one is stale by now
+            raise VersionConflict(course, course.version or 0)
 
-        existing_modules = {module.uuid: module for module in Module.objects.filter(course=course)}
+        try:
+            self.write_outline(course, validated_data, modules_data)
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                print(f"Saving course {course.uuid} outlasted its lock")
 
-        updated_module_uuids = set()
+        forget_navigation(course.pk)
+
+        return course
+    
+    def write_outline(self, course, validated_data, modules_data):
+        """
+        Checks every version against the stored one, then writes the
+        modules and the course last, so a conflict writes nothing.
+        """
+        existing_modules = {module.uuid: module for module in Module.objects.filter(course=course).exclude("content")}
+
+        # `course` may have been read before the previous save got the lock
+        stored = Course.objects(pk=course.pk).scalar("version").first() or 0
+        if stored != (course.version or 0):
+            raise VersionConflict(course, stored)
+
+        expected = [(course, validated_data.get("version"))] + [
+            (existing_modules[module_data["uuid"]], module_data.get("version"))
+            for module_data in modules_data
+            if module_data.get("uuid") in existing_modules
+        ]
+        for document, version in expected:
+            if version is not None and version != (document.version or 0):
+                raise VersionConflict(document, document.version or 0)
+
+        inserts = []
+        updates = []
+        kept = set()
 
         for i, module_data in enumerate(modules_data):
-            module_uuid = module_data.pop("uuid", None)
-            module_data['course_uuid'] = course.uuid
-            module_data['order'] = i
+            module_uuid = module_data.get("uuid", None)
 
             if module_uuid and module_uuid in existing_modules:
                 module = existing_modules[module_uuid]
-                ModuleSerializer(context=self.context).update(module, module_data)
-                updated_module_uuids.add(module_uuid)
+                module_changes = changed_fields(module, {**module_data, "order": i}, self.MODULE_FIELDS)
+
+                if module_changes:
+                    updates.append((module, module_changes))
+                kept.add(module_uuid)
             else:
-                new_module = ModuleSerializer(context=self.context).create(module_data)
-                updated_module_uuids.add(new_module.uuid)
+                inserts.append(self.new_module(course, module_data, i))
 
-        for module in Module.objects.filter(course = course):
-            if module.uuid not in updated_module_uuids:
-                module.delete()
+        removed = [uuid for uuid in existing_modules if uuid not in kept]
+
+        write_modules(course, inserts, updates, removed)
+
+        course_changes = changed_fields(course, validated_data, self.COURSE_FIELDS)
+        if course_changes:
+            compare_and_set(course, course_changes)
 
-        return course
-    
     def to_representation(self, instance):
         representation = super().to_representation(instance)
 
-        if isinstance(instance, str):  # Check if it's a Course instance
+        if isinstance(instance, Course):
+            course = instance
+        elif isinstance(instance, str):
             course = Course.objects.get(uuid=instance)
         else:
-        # If instance is a UUID or some other identifier, use it to fetch the Course
+        # If instance is validated data, use its uuid to fetch the Course
             course = Course.objects.get(uuid=instance["uuid"])
 
-        representation['modules'] = ModuleSerializer(
-            Module.objects.filter(course=course).order_by('order'),
-            many = True
-        ).data
+        # Listed courses get their modules from CourseListSerializer's batch
+        loaded = self.context.get("modules", {})
+        if course.pk in loaded:
+            modules = loaded[course.pk]
+        else:
+            modules = Module.objects.filter(course=course).order_by('order')
+
+        representation['modules'] = ModuleSerializer(modules, many=True).data
 
         return representation
     
@@ -201,24 +429,36 @@ class PageSerializer(rf_serializers.Serializer):
         return data
 
     def to_representation(self, instance):
-        """Modify how data is serialized and returned"""
+        """Modify how data is serialized and returned
+
+        Prev/next/total come from the course's cached navigation index, so a
+        page costs one module query when the index is warm.
+        """
+        fields = ("uuid", "course", "content")
 
         if instance.get("currentPage", None):
-            module = Module.objects.filter(uuid=instance["currentPage"]).first()
-            course = module.course
+            module = Module.objects(uuid=instance["currentPage"]).only(*fields).no_dereference().first()
+            course_id = module.course.id
+            index = navigation_index(course_id)
         if instance.get("course", None):
-            course = Course.objects.get(uuid=instance["course"])
-            module: dict = Module.objects.filter(course=course).order_by('order').first()
+            course_id = Course.objects(uuid=instance["course"]).scalar("id").first()
+            index = navigation_index(course_id)
+            module = Module.objects(uuid=index["modules"][0]).only(*fields).first()
+
+        if module.uuid not in index["modules"]:
+            # Modules changed without an outline save, rebuild the index
+            forget_navigation(course_id)
+            index = navigation_index(course_id)
 
-        prev_module = Module.objects.filter(course=course, order=module.order - 1).first()
-        next_module = Module.objects.filter(course=course, order=module.order + 1).first()
+        modules = index["modules"]
+        position = modules.index(module.uuid)
 
         return {
-            "prevPage": prev_module.uuid if prev_module else None,
-            "nextPage": next_module.uuid if next_module else None,
+            "prevPage": modules[position - 1] if position > 0 else None,
+            "nextPage": modules[position + 1] if position + 1 < len(modules) else None,
             "currentPage": module.uuid,
-            "course": course.uuid,
-            "total": Module.objects.filter(course=course).count(),
-            "current_order": (module.order + 1),
+            "course": index["course"],
+            "total": len(modules),
+            "current_order": (position + 1),
             "content": module.content
         }
\ No newline at end of file
@@ -0,0 +1,117 @@
+import asyncio
+import copy
+import json
+import time
+import uuid
+import redis
+from .redis_pool import async_redis
+
+RESULT_TTL = 60  # seconds a leader's result stays readable for followers in other processes
+
+# Compare-and-delete so a leader never releases a lock that expired and was re-taken
+RELEASE_LOCK = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls into one.
+
+    Within a process, callers with the same key await the first caller's
+    future. Across daphne workers, a Redis lock elects one leader; the
+    others poll for the result it publishes under the lock's token. If the
+    leader disappears without a result, a follower runs the call itself.
+    """
+    _inflight = {}
+
+    def __init__(self, client=None, poll_interval=0.25):
+        self.client = client or async_redis()
+        self.poll_interval = poll_interval
+
+    async def do(self, key, fn, lock_ttl):
+        """
+        Runs `fn()` once for every concurrent caller of `key`. Followers get
+        a deep copy of the result so callers can mutate what they receive.
+        """
+        while key in self._inflight:
+            inflight = self._inflight[key]
+            try:
+                return copy.deepcopy(await asyncio.shield(inflight))
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # the leader was cancelled, not this caller; the next one leads
+
+        future = asyncio.get_running_loop().create_future()
+        # mark exceptions as retrieved when no follower was waiting
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+
+        try:
+            result = await self.do_across_processes(key, fn, lock_ttl)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        except BaseException:
+            # e.g. daphne cancelling the leader's socket; that is not the
+            # followers' error, so they retry instead
+            future.cancel()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+        return result
+
+    async def do_across_processes(self, key, fn, lock_ttl):
+        lock_key = f"{key}:lock"
+        token = str(uuid.uuid4())
+
+        try:
+            leader = await self.client.set(lock_key, token, nx=True, ex=int(lock_ttl) + 1)
+        except redis.RedisError as e:
+            print(f"Single-flight lock unavailable: {e}")
+            return await fn()
+
+        if leader:
+            try:
+                result = await fn()
+                await self.client.set(f"{key}:result:{token}", json.dumps(result), ex=RESULT_TTL)
+                return result
+            finally:
+                await self.client.eval(RELEASE_LOCK, 1, lock_key, token)
+
+        return await self.follow(key, fn, lock_ttl)
+
+    async def follow(self, key, fn, lock_ttl):
+        lock_key = f"{key}:lock"
+        deadline = time.monotonic() + lock_ttl
+        leader_token = None
+
+        while time.monotonic() < deadline:
+            current_token = await self.client.get(lock_key)
+
+            if current_token is None:
+                break
+
+            leader_token = current_token
+
+            result = await self.client.get(f"{key}:result:{leader_token}")
+            if result is not None:
+                return json.loads(result)
+
+            await asyncio.sleep(self.poll_interval)
+
+        # the leader publishes before releasing, so look once more after it lets go
+        if leader_token is not None:
+            result = await self.client.get(f"{key}:result:{leader_token}")
+            if result is not None:
+                return json.loads(result)
+
+        return await fn()
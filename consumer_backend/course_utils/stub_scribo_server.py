@@ -0,0 +1,136 @@
+"""
+Stand-in for the Scribo model server, for local runs and benchmarks.
+
+    python -m course_utils.stub_scribo_server --port 8080 --latency 2 --error-rate 0.05
+
+Point REACT_APP_HUGGINGFACE_ADDRESS at it. It needs nothing beyond the
+standard library, so it can run without the Django settings.
+"""
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FEATURES = ["video", "image", "interactive"]
+
+
+def stub_outline(topic, time_required, module_count):
+    return {
+        "title": f"Introduction to {topic}",
+        "objectives": [f"Understand the basics of {topic}", f"Apply {topic} at work"],
+        "duration": str(time_required),
+        "summary": f"A short course covering the essentials of {topic}.",
+        "modules": [
+            {
+                "name": f"{topic} part {i + 1}",
+                "duration": "15 minutes",
+                "subtopics": [f"Subtopic {i + 1}.{j + 1}" for j in range(3)],
+                "features": [FEATURES[i % len(FEATURES)]],
+            }
+            for i in range(module_count)
+        ],
+    }
+
+
+def stub_page(module, words):
+    subtopics = "\n".join(f"## {subtopic}\n\n" + " ".join(["lorem"] * words) for subtopic in module.get("subtopics", []))
+    return f"# {module.get('name')}\n\n{subtopics}\n"
+
+
+def outline_response(outline):
+    return {"response": {"output_validator": {"valid_replies": json.dumps(outline)}}}
+
+
+class StubScriboHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    options = None
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)) or 0)
+        data = json.loads(body or b"{}")
+
+        time.sleep(max(0, random.gauss(self.options.latency, self.options.jitter)))
+
+        if random.random() < self.options.error_rate:
+            return self.reply(500, {"detail": "stub failure"})
+
+        if self.path == "/generate-outline":
+            outline = stub_outline(data.get("topic"), data.get("time"), self.options.modules)
+            return self.reply(200, outline_response(outline))
+
+        if self.path == "/update-outline":
+            script = data.get("script") or {}
+            changes = {"summary": f"{script.get('summary', '')} Revised: {data.get('notes')}".strip()}
+            return self.reply(200, outline_response(changes))
+
+        if self.path == "/generate-module-content":
+            modules = data.get("modules", [])
+
+            if data.get("stream"):
+                return self.stream("".join(stub_page(module, self.options.words) for module in modules))
+
+            pages = {module.get("name"): stub_page(module, self.options.words) for module in modules}
+            return self.reply(200, {"response": pages})
+
+        self.reply(404, {"detail": "not found"})
+
+    def reply(self, code, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream(self, text):
+        """Sends `text` as server-sent events, a few words per event."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        tokens = text.split(" ")
+        for i in range(0, len(tokens), 4):
+            chunk = " ".join(tokens[i:i + 4]) + (" " if i + 4 < len(tokens) else "")
+            self.chunk(f"data: {json.dumps({'token': chunk})}\n\n")
+            time.sleep(self.options.token_delay)
+
+        self.chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def chunk(self, text):
+        data = text.encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        if self.options.verbose:
+            super().log_message(format, *args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=1.0, help="Mean seconds before responding.")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Standard deviation of the latency.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 500.")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Seconds between streamed events.")
+    parser.add_argument("--modules", type=int, default=5, help="Modules per generated outline.")
+    parser.add_argument("--words", type=int, default=80, help="Words per generated subtopic.")
+    parser.add_argument("--verbose", action="store_true")
+    options = parser.parse_args()
+
+    StubScriboHandler.options = options
+    server = ThreadingHTTPServer((options.host, options.port), StubScriboHandler)
+    print(f"Stub Scribo server listening on http://{options.host}:{options.port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
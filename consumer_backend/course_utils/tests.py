@@ -1,3 +1,456 @@
-from django.test import TestCase
+import json
+import random
+import uuid
+import zlib
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+from mongoengine import connect, disconnect
+from mongoengine.connection import get_connection
+from pymongo.collection import Collection
+from organization_utils.models import Organization
+from .models import Course, Module, StatusEnum
+from .consumers import DocumentConsumer, OutlineActions, evict_page, generating_key
+from .framing import DEFLATED, FrameTooLarge, ZlibMsgpackCodec
+from .outline_patch import OutlineIndex, PatchError, apply_patch, changes_to_patch
+from .document_ops import APPLY_EDIT, EditRejected, apply, apply_edit, op_log_key, transform, validate
+from .redis_pool import redis_client
+from .serializers import CourseWithModulesSerializer, save_lock
+from .write_behind import DIRTY_KEY, _flushers, _last_edit, flush_now
 
-# Create your tests here.
+
+def count_queries(serialize):
+    """Runs `serialize` and returns its result and the number of finds it sent to Mongo."""
+    with mock.patch.object(Collection, "find", autospec=True, side_effect=Collection.find) as find:
+        result = serialize()
+    return result, find.call_count
+
+
+class MongoTestCase(SimpleTestCase):
+    """
+    Runs against a throwaway database on the configured server instead of
+    DB_NAME, dropped after every test.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.options = dict(settings.MONGODB_DATABASES["default"])
+        cls.database = cls.options.pop("name")
+        cls.test_database = f"test_{cls.database}"
+
+        disconnect()
+        connect(db=cls.test_database, **cls.options)
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+        connect(db=cls.database, **cls.options)
+        super().tearDownClass()
+
+    def tearDown(self):
+        get_connection().drop_database(self.test_database)
+
+
+class CourseListingQueriesTest(MongoTestCase):
+    def setUp(self):
+        self.organization = Organization(name="Listing")
+        self.organization.save()
+
+    def add_courses(self, count, modules=3):
+        for number in range(count):
+            course = Course(
+                title=f"Course {number}", organization=self.organization, status=StatusEnum.DRAFT.value
+            ).save()
+            # saved out of order so the listing has to sort them
+            for order in reversed(range(modules)):
+                Module(name=f"Module {order}", course=course, order=order).save()
+
+    def serialize_listing(self):
+        courses = Course.objects.filter(organization=self.organization)
+        return CourseWithModulesSerializer(courses, many=True).data
+
+    def test_listing_queries_do_not_grow_with_courses(self):
+        self.add_courses(1)
+        _, one_course = count_queries(self.serialize_listing)
+
+        self.add_courses(9)
+        data, ten_courses = count_queries(self.serialize_listing)
+
+        self.assertEqual(len(data), 10)
+        self.assertEqual(one_course, ten_courses)
+        # courses, their organizations, their modules
+        self.assertLessEqual(ten_courses, 3)
+
+    def test_listing_keeps_each_courses_modules_in_order(self):
+        self.add_courses(2)
+
+        for course in self.serialize_listing():
+            self.assertEqual(course["organization"], self.organization.uuid)
+            self.assertEqual(
+                [module["name"] for module in course["modules"]],
+                ["Module 0", "Module 1", "Module 2"],
+            )
+
+
+@mock.patch("course_utils.consumers.forget_prefetched")
+class OutlineSaveVersionTest(MongoTestCase):
+    def setUp(self):
+        self.organization = Organization(name="Saving")
+        self.organization.save()
+
+        self.course = Course(
+            title="Course", summary="Original", organization=self.organization, status=StatusEnum.DRAFT.value
+        ).save()
+        Module(name="Module", course=self.course, order=0).save()
+
+    def save(self, script):
+        return OutlineActions().save({"script": script})
+
+    def test_saved_outline_keeps_its_version(self, forget_prefetched):
+        saved, status = self.save(CourseWithModulesSerializer(self.course).data)
+
+        self.assertEqual(status, "good")
+        self.assertEqual(saved["version"], Course.objects.get(pk=self.course.pk).version)
+
+    def test_stale_save_after_another_save_conflicts(self, forget_prefetched):
+        # the room saves, then keeps editing the outline that save returned
+        room, status = self.save(CourseWithModulesSerializer(self.course).data)
+        self.assertEqual(status, "good")
+
+        # another writer saves in between
+        other = CourseWithModulesSerializer(Course.objects.get(pk=self.course.pk)).data
+        _, status = self.save({**other, "summary": "Theirs"})
+        self.assertEqual(status, "good")
+
+        _, status = self.save({**room, "summary": "Mine"})
+
+        self.assertEqual(status, "conflict")
+        self.assertEqual(Course.objects.get(pk=self.course.pk).summary, "Theirs")
+
+    def test_stale_module_writes_nothing(self, forget_prefetched):
+        room, _ = self.save(CourseWithModulesSerializer(self.course).data)
+
+        other = CourseWithModulesSerializer(Course.objects.get(pk=self.course.pk)).data
+        other["modules"][0]["name"] = "Theirs"
+        self.save(other)
+
+        room["summary"] = "Mine"
+        room["modules"][0]["name"] = "Mine"
+        room["modules"].append({"name": "Added"})
+        _, status = self.save(room)
+
+        self.assertEqual(status, "conflict")
+        self.assertEqual(Course.objects.get(pk=self.course.pk).summary, "Original")
+        self.assertEqual(list(Module.objects(course=self.course).scalar("name")), ["Theirs"])
+
+    @mock.patch("course_utils.serializers.SAVE_LOCK_WAIT", 0.1)
+    def test_save_waiting_on_another_save_conflicts(self, forget_prefetched):
+        script = {**CourseWithModulesSerializer(self.course).data, "summary": "Mine"}
+
+        with save_lock(self.course):
+            _, status = self.save(script)
+
+        self.assertEqual(status, "conflict")
+        self.assertEqual(Course.objects.get(pk=self.course.pk).summary, "Original")
+
+
+class ZlibFramingTest(SimpleTestCase):
+    def test_compressed_frame_round_trips(self):
+        message = {"action": "save", "data": {"content": "x" * 5000}}
+        frame = ZlibMsgpackCodec().encode(message)["bytes_data"]
+
+        self.assertEqual(frame[:1], DEFLATED)
+        self.assertEqual(ZlibMsgpackCodec().decode(bytes_data=frame), message)
+
+    @override_settings(SOCKET_FRAMING={**settings.SOCKET_FRAMING, "MAX_FRAME_BYTES": 1000})
+    def test_frame_inflating_past_the_limit_is_rejected(self):
+        bomb = DEFLATED + zlib.compress(b"\x00" * 100000)
+
+        with self.assertRaises(FrameTooLarge):
+            ZlibMsgpackCodec().decode(bytes_data=bomb)
+
+
+def random_ops(length, count, rng):
+    """`count` random ops made one after another against a text of `length` code points."""
+    ops = []
+    for _ in range(count):
+        if length and rng.random() < 0.5:
+            position = rng.randrange(length)
+            deleted = rng.randint(1, length - position)
+            ops.append({"p": position, "d": deleted})
+            length -= deleted
+        else:
+            text = "".join(rng.choice("xyzé€😀") for _ in range(rng.randint(1, 3)))
+            ops.append({"p": rng.randint(0, length), "i": text})
+            length += len(text)
+    return ops
+
+
+class DocumentOpsTest(SimpleTestCase):
+    def test_apply_inserts_and_deletes_in_order(self):
+        self.assertEqual(apply("hello world", [{"p": 5, "i": ","}, {"p": 6, "d": 6}]), "hello,")
+
+    def test_apply_counts_code_points(self):
+        self.assertEqual(apply("h😀llo", [{"p": 1, "d": 1}, {"p": 1, "i": "é"}]), "héllo")
+
+    def test_insert_shifts_over_earlier_insert(self):
+        self.assertEqual(transform([{"p": 5, "i": "X"}], [{"p": 0, "i": "ab"}]), [{"p": 7, "i": "X"}])
+
+    def test_insert_tie_follows_shift_on_tie(self):
+        self.assertEqual(transform([{"p": 0, "i": "a"}], [{"p": 0, "i": "b"}]), [{"p": 1, "i": "a"}])
+        self.assertEqual(transform([{"p": 0, "i": "a"}], [{"p": 0, "i": "b"}], False), [{"p": 0, "i": "a"}])
+
+    def test_delete_keeps_insert_inside_it(self):
+        ops = transform([{"p": 2, "d": 4}], [{"p": 4, "i": "XY"}])
+
+        self.assertEqual(apply("abcdXYefgh", ops), "abXYgh")
+
+    def test_overlapping_deletes_delete_once(self):
+        ops = transform([{"p": 1, "d": 3}], [{"p": 2, "d": 3}])
+
+        self.assertEqual(apply("abcdefg", [{"p": 2, "d": 3}] + ops), "afg")
+
+    def test_concurrent_edits_converge(self):
+        rng = random.Random(0)
+
+        for _ in range(2000):
+            text = "".join(rng.choice("abcdef") for _ in range(rng.randint(0, 12)))
+            ours = random_ops(len(text), rng.randint(1, 4), rng)
+            theirs = random_ops(len(text), rng.randint(1, 4), rng)
+
+            self.assertEqual(
+                apply(apply(text, theirs), transform(ours, theirs)),
+                apply(apply(text, ours), transform(theirs, ours, False)),
+            )
+
+    def test_long_edit_over_busy_log(self):
+        rng = random.Random(1)
+        text = "a" * 2000
+        ours = random_ops(len(text), 600, rng)
+        theirs = random_ops(len(text), 600, rng)
+
+        rebased = transform(ours, theirs)
+
+        self.assertEqual(
+            apply(apply(text, theirs), rebased),
+            apply(apply(text, ours), transform(theirs, ours, False)),
+        )
+
+    def test_validate_rejects_malformed_ops(self):
+        for ops in (None, [{"p": -1, "i": "a"}], [{"p": 0, "i": ""}], [{"p": 0, "d": 0}], [{"i": "a"}]):
+            with self.assertRaises(EditRejected):
+                validate(ops)
+
+    @override_settings(DOCUMENT_EDITING={**settings.DOCUMENT_EDITING, "MAX_EDIT_OPS": 2})
+    def test_validate_caps_ops_per_edit(self):
+        with self.assertRaises(EditRejected):
+            validate([{"p": 0, "i": "a"}] * 3)
+
+    def test_apply_edit_rejects_bad_page_or_version(self):
+        for page, version in ((None, 0), ("", 0), ("module", None), ("module", "1"), ("module", True), ("module", -1)):
+            with self.assertRaises(EditRejected):
+                async_to_sync(apply_edit)("room", page, version, [{"p": 0, "i": "a"}])
+
+
+def outline(*names):
+    return {
+        "uuid": "course",
+        "title": "Course",
+        "summary": "Summary",
+        "modules": [{"uuid": name.lower(), "name": name, "subtopics": []} for name in names],
+    }
+
+
+def module_names(patched):
+    return [module["name"] for module in patched["modules"]]
+
+
+class OutlinePatchTest(SimpleTestCase):
+    def test_move_reports_the_position_taken(self):
+        patched, applied = apply_patch(outline("A", "B", "C"), [
+            {"op": "move", "from": "/modules/c", "path": "/modules/0"},
+            {"op": "move", "from": "/modules/b", "path": "/modules/2"},
+        ])
+
+        self.assertEqual(module_names(patched), ["C", "A", "B"])
+        # the second move left B where it was
+        self.assertEqual(applied, [{"op": "move", "from": "/modules/c", "path": "/modules/0"}])
+
+    def test_add_at_position_and_append(self):
+        patched, applied = apply_patch(outline("A", "B"), [
+            {"op": "add", "path": "/modules/1", "value": {"uuid": "x", "name": "X"}},
+            {"op": "add", "path": "/modules/-", "value": {"uuid": "y", "name": "Y"}},
+        ])
+
+        self.assertEqual(module_names(patched), ["A", "X", "B", "Y"])
+        self.assertEqual([op["path"] for op in applied], ["/modules/1", "/modules/3"])
+
+    def test_replace_module_is_narrowed_to_what_differs(self):
+        _, applied = apply_patch(outline("A"), [
+            {"op": "replace", "path": "/modules/a", "value": {"uuid": "a", "name": "A", "duration": 5}},
+        ])
+
+        self.assertEqual(applied, [
+            {"op": "remove", "path": "/modules/a/subtopics"},
+            {"op": "add", "path": "/modules/a/duration", "value": 5},
+        ])
+
+    def test_unchanged_values_are_dropped(self):
+        _, applied = apply_patch(outline("A"), [
+            {"op": "replace", "path": "/summary", "value": "Summary"},
+            {"op": "replace", "path": "/modules/a/name", "value": "A"},
+        ])
+
+        self.assertEqual(applied, [])
+
+    def test_failed_patch_leaves_the_outline_alone(self):
+        original = outline("A", "B")
+        before = json.loads(json.dumps(original))
+
+        with self.assertRaises(PatchError):
+            apply_patch(original, [
+                {"op": "replace", "path": "/summary", "value": "Changed"},
+                {"op": "replace", "path": "/modules/a/name", "value": "Changed"},
+                {"op": "remove", "path": "/modules/missing"},
+            ])
+
+        self.assertEqual(original, before)
+
+    def test_replace_modules_rejects_bad_modules(self):
+        for modules in (["not a module"], [{"uuid": "a"}, {"uuid": "a"}], [{"uuid": 1}]):
+            with self.assertRaises(PatchError):
+                apply_patch(outline("A"), [{"op": "replace", "path": "/modules", "value": modules}])
+
+    def test_index_tracks_what_to_write_back(self):
+        index = OutlineIndex.of(outline("A", "B", "C"))
+        index.apply_all([
+            {"op": "replace", "path": "/modules/a/name", "value": "A2"},
+            {"op": "remove", "path": "/modules/b"},
+        ])
+
+        self.assertEqual(index.changed, {"a"})
+        self.assertEqual(index.removed, {"b"})
+        self.assertTrue(index.reordered)
+        self.assertFalse(index.fields_changed)
+
+    def test_index_needs_only_the_named_modules(self):
+        index = OutlineIndex({"title": "Course"}, ["a", "b", "c"], {"b": {"uuid": "b", "name": "B"}})
+
+        applied = index.apply_all([{"op": "replace", "path": "/modules/b/name", "value": "B2"}])
+
+        self.assertEqual(applied, [{"op": "replace", "path": "/modules/b/name", "value": "B2"}])
+        self.assertEqual(index.changed, {"b"})
+        self.assertFalse(index.reordered)
+
+    def test_changes_to_patch_ignores_unknown_modules(self):
+        patch = changes_to_patch(outline("A"), {
+            "summary": "New",
+            "moduleChanges": {
+                "add": [{"uuid": "x", "name": "X"}],
+                "remove": ["missing"],
+                "update": [{"uuid": "a", "name": "A2"}, {"uuid": "missing", "name": "M"}],
+            },
+        })
+
+        patched, _ = apply_patch(outline("A"), patch)
+
+        self.assertEqual(module_names(patched), ["A2", "X"])
+        self.assertEqual(patched["summary"], "New")
+
+
+class ApplyEditScriptTest(SimpleTestCase):
+    """The Lua script applies ops exactly like document_ops.apply."""
+
+    def setUp(self):
+        self.room = f"test-{uuid.uuid4()}"
+        self.script = redis_client.register_script(APPLY_EDIT)
+
+    def tearDown(self):
+        redis_client.delete(f"page:{self.room}", op_log_key(self.room))
+
+    def apply_in_redis(self, text, ops):
+        redis_client.set(f"page:{self.room}", json.dumps({"currentPage": "module", "version": 0, "content": text}))
+        redis_client.delete(op_log_key(self.room))
+
+        applied, _ = self.script(keys=[f"page:{self.room}", op_log_key(self.room)], args=["module", 0, json.dumps(ops), 10])
+        self.assertEqual(applied, 1)
+
+        return json.loads(redis_client.get(f"page:{self.room}"))["content"]
+
+    def test_script_matches_python(self):
+        rng = random.Random(2)
+
+        for _ in range(200):
+            text = "".join(rng.choice("abé€😀") for _ in range(rng.randint(0, 12)))
+            ops = random_ops(len(text), rng.randint(1, 5), rng)
+
+            self.assertEqual(self.apply_in_redis(text, ops), apply(text, ops))
+
+
+class WriteBehindFailureTest(SimpleTestCase):
+    """A flush that fails keeps the unsaved page instead of losing it."""
+
+    def setUp(self):
+        self.room = f"test-{uuid.uuid4()}"
+        redis_client.set(f"page:{self.room}", json.dumps({"currentPage": "module", "version": 3, "content": "Unsaved"}))
+        redis_client.hset(DIRTY_KEY, self.room, 0)
+
+    def tearDown(self):
+        redis_client.delete(f"page:{self.room}", op_log_key(self.room))
+        redis_client.hdel(DIRTY_KEY, self.room)
+        _last_edit.pop(self.room, None)
+
+    @mock.patch("course_utils.write_behind.save_module_content", side_effect=Exception("Mongo is down"))
+    def test_failed_flush_keeps_page_and_retries(self, save_module_content):
+        async def last_member_leaves():
+            flushed = await flush_now(self.room)
+            evicted = await evict_page(self.room)
+
+            retry = _flushers.pop(self.room, None)
+            if retry:
+                retry.cancel()
+            return flushed, evicted, retry is not None
+
+        flushed, evicted, retrying = async_to_sync(last_member_leaves)()
+
+        self.assertFalse(flushed)
+        self.assertFalse(evicted)
+        self.assertTrue(retrying)
+        self.assertEqual(json.loads(redis_client.get(f"page:{self.room}"))["content"], "Unsaved")
+        self.assertTrue(redis_client.hexists(DIRTY_KEY, self.room))
+
+
+class GenerationLockTest(SimpleTestCase):
+    def setUp(self):
+        self.room = f"test-{uuid.uuid4()}"
+        self.consumer = DocumentConsumer()
+        self.consumer.room_name = self.room
+        self.consumer.generation = None
+        redis_client.set(generating_key(self.room), "token")
+
+    def tearDown(self):
+        redis_client.delete(generating_key(self.room))
+
+    @mock.patch("course_utils.consumers.get_page_request", new_callable=mock.AsyncMock, side_effect=Module.DoesNotExist)
+    def test_missing_module_is_reported_and_frees_the_room(self, get_page_request):
+        with mock.patch.object(DocumentConsumer, "broadcast", new_callable=mock.AsyncMock) as broadcast:
+            async_to_sync(self.consumer.stream_generation)("module", "token")
+
+        self.assertEqual(broadcast.call_args.args[0]["status"], "bad")
+        self.assertFalse(redis_client.exists(generating_key(self.room)))
+
+    def test_generate_is_refused_while_the_room_generates(self):
+        self.consumer.decode_message = lambda text_data, bytes_data: {"action": "generate"}
+
+        async def generate():
+            with mock.patch("course_utils.consumers.get_cached", new_callable=mock.AsyncMock, return_value={"currentPage": "module"}), \
+                    mock.patch.object(DocumentConsumer, "send_message", new_callable=mock.AsyncMock) as send_message:
+                await self.consumer.receive(text_data="{}")
+            return send_message
+
+        send_message = async_to_sync(generate)()
+
+        self.assertEqual(send_message.call_args.args[0]["status"], "busy")
+        self.assertIsNone(self.consumer.generation)
@@ -4,4 +4,6 @@ from .views import *
 urlpatterns = [
     path("course/", CourseView.as_view(), name="course"),
     path("pages/", PageView.as_view(), name="pages"),
+    path("jobs/", JobView.as_view(), name="jobs"),
+    path("scribo-status/", ScriboStatusView.as_view(), name="scribo-status"),
 ]
@@ -7,7 +7,16 @@ from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 import json
 from .scribo_handler import ScriboHandler
+from .generation import pending_modules, generate_pages, generate_pages_concurrently
+from .jobs import enqueue, get_job, JobTypes
+from .circuit_breaker import ScriboBusyError, status as scribo_status
+from .scribo_cache import ScriboCache
+from .db_pool import db_pool
+from .broadcast import coalescer
+from .room_cache import invalidate_course, invalidate_outline
+from asgiref.sync import async_to_sync
 from organization_utils.models import Member, Organization, Roles
+from organization_utils.pagination import InvalidCursor, paginate
 from rest_framework.permissions import IsAuthenticated
 from organization_utils.permissions import IsOwnerOrAdmin
 from rest_framework.views import APIView
@@ -57,7 +66,27 @@ class CourseView(APIView):
 
             scribo = ScriboHandler()
 
-            course_outline = scribo.generate_course_outline(request.data)
+            # "refresh" skips the cached outline for an identical request
+            use_cache = not request.data.get("refresh")
+            outline_request = {
+                key: value
+                for key, value in request.data.items()
+                if key not in ("background", "refresh")
+            }
+
+            # Background mode: a scribo_worker generates the outline
+            if request.data.get("background"):
+                scribo.validate_outline_request(outline_request)
+
+                job_id = enqueue(JobTypes.OUTLINE, {
+                    "data": outline_request,
+                    "organization": member.organization.uuid,
+                    "use_cache": use_cache,
+                })
+
+                return Response({"job": job_id}, status=status.HTTP_202_ACCEPTED)
+
+            course_outline = scribo.generate_course_outline(outline_request, use_cache=use_cache)
 
             course_outline["organization"] = member.organization.uuid
 
@@ -71,6 +100,8 @@ class CourseView(APIView):
             return Response(course_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         except Member.DoesNotExist:
             return Response("member doesnt exist...", status=status.HTTP_404_NOT_FOUND)
+        except ScriboBusyError as e:
+            return Response(str(e), status=status.HTTP_503_SERVICE_UNAVAILABLE)
         
     def get(self, request):
         if request.query_params.get("course", None):
@@ -86,13 +117,17 @@ class CourseView(APIView):
         if request.query_params.get("organization", None):
             try:
                 organization = Organization.objects.get(uuid=request.query_params.get("organization"))
-                courses = Course.objects.filter(organization=organization)
+                courses, next_cursor = paginate(
+                    Course.objects.filter(organization=organization), request, select_related=True
+                )
 
                 courses_serializer = CourseWithModulesSerializer(courses, many=True)
 
-                return Response({"courses": courses_serializer.data}, status=status.HTTP_200_OK)
+                return Response({"courses": courses_serializer.data, "next": next_cursor}, status=status.HTTP_200_OK)
             except Organization.DoesNotExist:
                 return Response("Organization not found.", status=status.HTTP_404_NOT_FOUND)
+            except InvalidCursor as e:
+                return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
         
         try:
             user = request.user
@@ -104,11 +139,15 @@ class CourseView(APIView):
             else:
                 courses = Course.objects.filter(organization=member.organization).filter(status='published')
 
+            courses, next_cursor = paginate(courses, request, select_related=True)
+
             courses_serializer = CourseWithModulesSerializer(courses, many=True)
 
-            return Response({"courses": courses_serializer.data}, status=status.HTTP_200_OK)
+            return Response({"courses": courses_serializer.data, "next": next_cursor}, status=status.HTTP_200_OK)
         except Member.DoesNotExist:
             return Response("member doesnt exist...", status=status.HTTP_404_NOT_FOUND)
+        except InvalidCursor as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
             
         return Response("Invalid Request", status=status.HTTP_400_BAD_REQUEST)
     
@@ -117,6 +156,7 @@ class CourseView(APIView):
             course = Course.objects.get(uuid=request.data["course"])
 
             course.delete()
+            invalidate_course(course.uuid)
 
             return Response("Course deleted.", status=status.HTTP_200_OK)
 
@@ -129,6 +169,7 @@ class CourseView(APIView):
                 course: Course = Course.objects.get(uuid=course_uuid)
 
                 course.toPublish().save()
+                invalidate_outline(course.uuid)
 
                 return Response("Course published successfully.", status=status.HTTP_201_CREATED)
             
@@ -137,6 +178,7 @@ class CourseView(APIView):
                 course: Course = Course.objects.get(uuid=course_uuid)
 
                 course.toDraft().save()
+                invalidate_outline(course.uuid)
 
                 return Response("Course successfully saved as a draft.", status=status.HTTP_201_CREATED)
 
@@ -147,39 +189,61 @@ class CourseView(APIView):
 
 class PageView(APIView):
     def post(self, request):
-        scribo = ScriboHandler()
-
+        """
+        Generates content for every module still holding "No data.".
+
+        ### Request:
+        - course: The uuid of the course.
+        - parallel: Send one request per module, `SCRIBO["PAGE_CONCURRENCY"]` at a time.
+        - stream: Skip generation here and stream it over the document socket.
+        - background: Queue the generation for a scribo_worker and return its job id.
+
+        ### Response:
+        - 201: Every pending module was generated.
+        - 207: Some modules were not; their uuids are in "skipped".
+        - 503: None were.
+        """
         try:
             course = Course.objects.get(uuid=request.data['course'])
 
-            modules: list[Module] = Module.objects.filter(course=course).order_by('order')
+            first_module = Module.objects.filter(course=course).order_by('order').first()
 
-            data = {
-                "title": course.title,
-                "modules": []
-            }
+            # Streaming mode: content is generated over the document socket
+            if request.data.get("stream"):
+                page_serializer = PageSerializer({"currentPage": first_module.uuid})
 
-            for module in modules:
-                if module.content == "No data.":
-                    data["modules"].append({
-                        "name": module.name,
-                        "duration": module.duration,
-                        "subtopics": list(module.subtopics)
-                    })
-        
-            generated_pages: dict = scribo.generate_page(data)
+                return Response(page_serializer.data, status=status.HTTP_202_ACCEPTED)
 
-            for module in modules:
-                if module.content == "No data.":
-                    module.content = generated_pages.get(module.name, "No data.")
-                    module.save()
-            
+            if request.data.get("background"):
+                job_id = enqueue(JobTypes.PAGES, {"course": course.uuid})
+
+                return Response({"job": job_id}, status=status.HTTP_202_ACCEPTED)
+
+            modules = pending_modules(course)
+            skipped = []
+
+            if modules and request.data.get("parallel"):
+                skipped = async_to_sync(generate_pages_concurrently)(course, modules)
+            elif modules:
+                skipped = generate_pages(course, modules)
+
+            if skipped and len(skipped) == len(modules):
+                return Response(
+                    {"error": "No content could be generated.", "skipped": skipped},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                )
 
-            page_serializer = PageSerializer({"currentPage": modules[0].uuid})
+            page_serializer = PageSerializer({"currentPage": first_module.uuid})
+
+            if skipped:
+                # Modules left with "No data." are picked up by the next request
+                return Response({**page_serializer.data, "skipped": skipped}, status=status.HTTP_207_MULTI_STATUS)
 
             return Response(page_serializer.data, status=status.HTTP_201_CREATED)
         except Course.DoesNotExist:
             return Response("Invalid course uuid.", status=status.HTTP_404_NOT_FOUND)
+        except ScriboBusyError as e:
+            return Response(str(e), status=status.HTTP_503_SERVICE_UNAVAILABLE)
     
     def get(self, request):
         data = {}
@@ -199,3 +263,35 @@ class PageView(APIView):
             return Response(page_serializer.data, status=status.HTTP_200_OK)
 
         return Response({"error": page_serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class JobView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        Returns the status, progress and result of a generation job.
+        """
+        job = get_job(request.query_params.get("job", ""))
+
+        if job is None:
+            return Response("Job not found.", status=status.HTTP_404_NOT_FOUND)
+
+        return Response({"job": job}, status=status.HTTP_200_OK)
+
+
+class ScriboStatusView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        Returns this worker's circuit breaker and concurrency limit state, the
+        shared Scribo cache counters, the consumers' database pool stats and
+        how many room broadcasts were coalesced per group message.
+        """
+        return Response({
+            **scribo_status(),
+            "cache": ScriboCache().stats(),
+            "consumer_db": db_pool.stats(),
+            "broadcasts": coalescer.stats(),
+        }, status=status.HTTP_200_OK)
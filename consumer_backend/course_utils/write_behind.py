@@ -0,0 +1,110 @@
+"""
+Write-behind persistence of live page edits.
+
+Edits land in the cached page in Redis; the room is then marked dirty and
+a flush is scheduled once editing pauses for ``FLUSH_DELAY`` seconds, or
+after ``FLUSH_MAX_DELAY`` at the latest while edits keep coming. A flush
+writes the page's current content with a single update_one, however many
+edits it covers. Navigating away, saving and disconnecting flush at once.
+
+A flush that fails leaves the room dirty and is retried after
+``FLUSH_DELAY``; callers about to drop or replace the page must check
+that it succeeded first.
+"""
+import asyncio
+import json
+import time
+from django.conf import settings
+from .db_pool import db_task
+from .models import Module
+from .redis_pool import async_redis
+
+DIRTY_KEY = "pages:dirty"  # hash of room -> time it first had unsaved edits
+
+# Marks the room clean unless the page was edited again after it was read
+# for the flush. KEYS: page, dirty hash. ARGV: room, flushed version.
+CLEAR_IF_FLUSHED = """
+local page = redis.call("get", KEYS[1])
+if page and (tonumber(cjson.decode(page)["version"]) or 0) ~= tonumber(ARGV[2]) then
+    return 0
+end
+return redis.call("hdel", KEYS[2], ARGV[1])
+"""
+
+_last_edit = {}  # room -> monotonic time of its latest edit
+_flushers = {}  # room -> task waiting to flush it
+
+
+@db_task
+def save_module_content(module_uuid, content):
+    Module.objects(uuid=module_uuid).update_one(set__content=content)
+
+
+async def mark_dirty(room_name):
+    """Records an edit to the room's page and schedules its flush."""
+    await async_redis().hsetnx(DIRTY_KEY, room_name, time.time())
+
+    _last_edit[room_name] = time.monotonic()
+    if room_name not in _flushers:
+        _flushers[room_name] = asyncio.ensure_future(_flush_later(room_name))
+
+
+async def _flush_later(room_name):
+    delay = settings.DOCUMENT_EDITING["FLUSH_DELAY"]
+    deadline = time.monotonic() + settings.DOCUMENT_EDITING["FLUSH_MAX_DELAY"]
+
+    try:
+        while True:
+            remaining = min(_last_edit[room_name] + delay, deadline) - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+    finally:
+        if _flushers.get(room_name) is asyncio.current_task():
+            del _flushers[room_name]
+            _last_edit.pop(room_name, None)
+
+    await flush(room_name)
+
+
+async def flush(room_name):
+    """
+    Persists the room's page if it has unsaved edits. Returns False if
+    they could not be saved; they stay in Redis and a retry is scheduled.
+    """
+    client = async_redis()
+
+    if not await client.hexists(DIRTY_KEY, room_name):
+        return True
+
+    cached = await client.get(f"page:{room_name}")
+    page = json.loads(cached) if cached else {}
+
+    try:
+        if page.get("currentPage"):
+            await save_module_content(page["currentPage"], page.get("content"))
+    except Exception as e:
+        print(f"Failed to flush page {room_name}, retrying: {e}")
+        _retry_later(room_name)
+        return False
+
+    script = client.register_script(CLEAR_IF_FLUSHED)
+    await script(keys=[f"page:{room_name}", DIRTY_KEY], args=[room_name, page.get("version", 0)])
+    return True
+
+
+def _retry_later(room_name):
+    """Schedules another flush as if the page had just been edited."""
+    _last_edit[room_name] = time.monotonic()
+    if room_name not in _flushers:
+        _flushers[room_name] = asyncio.ensure_future(_flush_later(room_name))
+
+
+async def flush_now(room_name):
+    """Flushes straight away instead of waiting for the scheduled flush."""
+    flusher = _flushers.pop(room_name, None)
+    _last_edit.pop(room_name, None)
+    if flusher:
+        flusher.cancel()
+
+    return await flush(room_name)
@@ -233,4 +233,107 @@ CACHES = {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
         }
     }
-}
\ No newline at end of file
+}
+
+# Connection pools for the redis clients in course_utils.redis_pool
+REDIS_POOL = {
+    "MAX_CONNECTIONS": int(os.getenv("REDIS_MAX_CONNECTIONS", 50)),
+    # seconds a consumer waits for a free async connection before failing
+    "TIMEOUT": float(os.getenv("REDIS_POOL_TIMEOUT", 5)),
+}
+
+# Scribo model server
+SCRIBO = {
+    "ADDRESS": os.getenv("REACT_APP_HUGGINGFACE_ADDRESS"),
+    "MAX_CONNECTIONS": int(os.getenv("SCRIBO_MAX_CONNECTIONS", 20)),
+    "MAX_KEEPALIVE_CONNECTIONS": int(os.getenv("SCRIBO_MAX_KEEPALIVE_CONNECTIONS", 10)),
+    "KEEPALIVE_EXPIRY": float(os.getenv("SCRIBO_KEEPALIVE_EXPIRY", 30)),
+    # adaptive (AIMD) limit on requests in flight per process; calls over it fail fast
+    "MIN_CONCURRENT_REQUESTS": int(os.getenv("SCRIBO_MIN_CONCURRENT_REQUESTS", 1)),
+    "MAX_CONCURRENT_REQUESTS": int(os.getenv("SCRIBO_MAX_CONCURRENT_REQUESTS", 4)),
+    # circuit breaker: open after N consecutive failures, retry after the timeout (seconds)
+    "BREAKER_FAILURE_THRESHOLD": int(os.getenv("SCRIBO_BREAKER_FAILURE_THRESHOLD", 5)),
+    "BREAKER_RESET_TIMEOUT": float(os.getenv("SCRIBO_BREAKER_RESET_TIMEOUT", 30)),
+    "CONNECT_TIMEOUT": float(os.getenv("SCRIBO_CONNECT_TIMEOUT", 5)),
+    "DEFAULT_TIMEOUT": float(os.getenv("SCRIBO_DEFAULT_TIMEOUT", 120)),
+    # modules generated at once when pages are fanned out one request per module
+    "PAGE_CONCURRENCY": int(os.getenv("SCRIBO_PAGE_CONCURRENCY", 4)),
+    # outline responses cached by payload hash; least recently used evicted past the cap
+    "CACHE_TTL": int(os.getenv("SCRIBO_CACHE_TTL", 60 * 60 * 24)),
+    "CACHE_MAX_ENTRIES": int(os.getenv("SCRIBO_CACHE_MAX_ENTRIES", 1000)),
+    # read timeouts per endpoint, in seconds
+    "TIMEOUTS": {
+        "/generate-outline": float(os.getenv("SCRIBO_OUTLINE_TIMEOUT", 120)),
+        "/update-outline": float(os.getenv("SCRIBO_OUTLINE_TIMEOUT", 120)),
+        "/generate-module-content": float(os.getenv("SCRIBO_PAGE_TIMEOUT", 600)),
+    },
+}
+
+# Threads the websocket consumers run mongoengine queries on
+CONSUMER_DB_POOL = {
+    "WORKERS": int(os.getenv("CONSUMER_DB_WORKERS", 8)),
+}
+
+# Collaborative page editing
+DOCUMENT_EDITING = {
+    # applied edits kept per page for rebasing late deltas; older ones must resync
+    "OP_LOG_SIZE": int(os.getenv("DOCUMENT_OP_LOG_SIZE", 200)),
+    # larger edits are rejected; the client sends the full page instead
+    "MAX_EDIT_OPS": int(os.getenv("DOCUMENT_MAX_EDIT_OPS", 500)),
+    # live edits are written to Mongo once editing pauses this long (seconds)...
+    "FLUSH_DELAY": float(os.getenv("DOCUMENT_FLUSH_DELAY", 2)),
+    # ...or this long after the first unsaved edit while it doesn't
+    "FLUSH_MAX_DELAY": float(os.getenv("DOCUMENT_FLUSH_MAX_DELAY", 10)),
+    # members heartbeat this often and count as gone after PRESENCE_TIMEOUT
+    "HEARTBEAT_INTERVAL": float(os.getenv("DOCUMENT_HEARTBEAT_INTERVAL", 15)),
+    "PRESENCE_TIMEOUT": float(os.getenv("DOCUMENT_PRESENCE_TIMEOUT", 45)),
+    # pages prefetched either side of the one a room is showing, and for how long
+    "PREFETCH_DEPTH": int(os.getenv("DOCUMENT_PREFETCH_DEPTH", 1)),
+    "PREFETCH_TTL": int(os.getenv("DOCUMENT_PREFETCH_TTL", 300)),
+    # ordered module uuids per course behind PageSerializer's prev/next
+    "NAVIGATION_TTL": int(os.getenv("DOCUMENT_NAVIGATION_TTL", 3600)),
+    # a room generates one page at a time; a lock left by a dead worker expires after this
+    "GENERATION_TTL": int(os.getenv("DOCUMENT_GENERATION_TTL", 900)),
+}
+
+# Markdown rendering of module content
+MARKDOWN_RENDERING = {
+    "CACHE_ENTRIES": int(os.getenv("MARKDOWN_CACHE_ENTRIES", 256)),
+    # documents at least this many characters are converted in a process pool
+    "PROCESS_POOL_THRESHOLD": int(os.getenv("MARKDOWN_PROCESS_POOL_THRESHOLD", 100_000)),
+    "PROCESSES": int(os.getenv("MARKDOWN_PROCESSES", 2)),
+}
+
+# Binary websocket frames for clients that negotiate scribo.msgpack.zlib
+SOCKET_FRAMING = {
+    # smaller frames are sent uncompressed, zlib would only add overhead
+    "COMPRESS_MIN_BYTES": int(os.getenv("SOCKET_COMPRESS_MIN_BYTES", 1024)),
+    "COMPRESS_LEVEL": int(os.getenv("SOCKET_COMPRESS_LEVEL", 6)),
+    # compressed frames from clients are rejected past this size inflated
+    "MAX_FRAME_BYTES": int(os.getenv("SOCKET_MAX_FRAME_BYTES", 1024 * 1024)),
+}
+
+# Room broadcasts within a tick go out as one group message; 0 sends each at once
+BROADCAST = {
+    "TICK": float(os.getenv("BROADCAST_TICK", 0.05)),
+}
+
+# Expiry of the outline and page state the course sockets share in Redis
+ROOM_CACHE = {
+    "OUTLINE_TTL": int(os.getenv("OUTLINE_CACHE_TTL", 86400)),
+    # live document rooms keep refreshing it with their heartbeats
+    "PAGE_TTL": int(os.getenv("PAGE_CACHE_TTL", 3600)),
+}
+
+# Course and member listings, see organization_utils.pagination
+PAGINATION = {
+    "PAGE_SIZE": int(os.getenv("PAGINATION_PAGE_SIZE", 50)),
+    "MAX_PAGE_SIZE": int(os.getenv("PAGINATION_MAX_PAGE_SIZE", 200)),
+}
+
+OUTLINE_HISTORY = {
+    # a full outline is kept every this many versions
+    "SNAPSHOT_EVERY": int(os.getenv("OUTLINE_HISTORY_SNAPSHOT_EVERY", 20)),
+    "MAX_VERSIONS": int(os.getenv("OUTLINE_HISTORY_MAX_VERSIONS", 200)),
+    "TTL": int(os.getenv("OUTLINE_HISTORY_TTL", 7 * 24 * 3600)),
+}
@@ -0,0 +1,63 @@
+"""
+Keyset pagination for organization listings.
+
+Pages are ordered by ``_id`` and a page starts after the ``_id`` its cursor
+holds, so fetching a page costs the same however deep into the listing it
+is, and documents added meanwhile neither shift nor repeat entries. The
+page size comes from ``?limit=``, capped at ``PAGINATION["MAX_PAGE_SIZE"]``.
+"""
+import base64
+import binascii
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+
+
+class InvalidCursor(Exception):
+    """The cursor was not issued by paginate."""
+
+
+def encode_cursor(pk):
+    return base64.urlsafe_b64encode(str(pk).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        return ObjectId(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (binascii.Error, InvalidId, UnicodeError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor {cursor!r}") from e
+
+
+def page_size(request):
+    options = settings.PAGINATION
+
+    try:
+        size = int(request.query_params.get("limit", options["PAGE_SIZE"]))
+    except ValueError:
+        size = options["PAGE_SIZE"]
+
+    return max(1, min(size, options["MAX_PAGE_SIZE"]))
+
+
+def paginate(queryset, request, select_related=False):
+    """
+    The page of `queryset` after the request's ``?cursor=`` and the cursor
+    of the page after it, or None on the last page. With `select_related`
+    the page's direct references are dereferenced in one query per
+    collection; otherwise they load lazily, if at all.
+    """
+    size = page_size(request)
+    cursor = request.query_params.get("cursor")
+
+    if cursor:
+        queryset = queryset.filter(pk__gt=decode_cursor(cursor))
+
+    # one extra document tells whether there is a next page
+    page = queryset.order_by("id").limit(size + 1)
+    documents = page.select_related(max_depth=1) if select_related else list(page)
+
+    if len(documents) > size:
+        documents = documents[:size]
+        return documents, encode_cursor(documents[-1].pk)
+
+    return documents, None
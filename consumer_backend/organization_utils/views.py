@@ -7,6 +7,7 @@ from rest_framework.views import APIView
 from rest_framework import status
 from .models import Organization, Invitation, Member, Roles
 from .serializers import OrganizationSerializer, MemberSerializer, InviteMemberSerializer
+from .pagination import InvalidCursor, paginate
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from rest_framework.permissions import IsAuthenticated
@@ -225,7 +226,15 @@ class OrganizationView(APIView):
 
         organization = Member.objects.get(user_name=user.username).organization
         if organization:
-            organization_members = Member.objects(organization=organization)
+            try:
+                organization_members, next_cursor = paginate(Member.objects(organization=organization), request)
+            except InvalidCursor as e:
+                return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+            # All share the organization already loaded; dereferencing
+            # would cost a query per member, and authuser is never shown
+            for member in organization_members:
+                member.organization = organization
 
             # members = []
             # for member in organization_members:
@@ -239,7 +248,8 @@ class OrganizationView(APIView):
 
             data = {
                 "organization": org_data,
-                "members": members_data
+                "members": members_data,
+                "next": next_cursor
             }
 
             return Response(data, status=status.HTTP_200_OK)
@@ -1,6 +1,6 @@
 import React, { useEffect, useState, useRef } from 'react';
 import { useAuth } from '../utils/AuthContext';
-import axios from 'axios';
+import axios, { type AxiosResponse } from 'axios';
 import { toast } from 'react-toastify';
 import 'react-toastify/dist/ReactToastify.css';
 import { FiEdit2, FiTrash2, FiMail, FiUserPlus, FiX, FiCheck, FiUser } from 'react-icons/fi';
@@ -41,17 +41,26 @@ const MemberTable = () => {
   const [members, setMembers] = useState<Member[]>([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
+  const [next, setNext] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [selectedMember, setSelectedMember] = useState<Member | null>(null);
   const [isMemberActionFormOpen, setIsMemberActionFormOpen] = useState(false);
   const [isInviteModalOpen, setIsInviteModalOpen] = useState(false);
 
+  // The listing comes in pages: the first on mount, the next ones on "Load more"
+  const fetchMembers = async (cursor: string | null = null) => {
+    const response: AxiosResponse = await axios.get(`${import.meta.env.VITE_BACKEND_ADDRESS}/org/organization`, {
+      withCredentials: true,
+      params: cursor ? { cursor } : {},
+    });
+    setMembers((loaded) => (cursor ? [...loaded, ...response.data.members] : response.data.members));
+    setNext(response.data.next ?? null);
+  };
+
   useEffect(() => {
-    const fetchMembers = async () => {
+    const loadFirstPage = async () => {
       try {
-        const response = await axios.get(`${import.meta.env.VITE_BACKEND_ADDRESS}/org/organization`, {
-          withCredentials: true,
-        });
-        setMembers(response.data.members);
+        await fetchMembers();
       } catch (err) {
         console.error("Error fetching members:", err);
         setError('Failed to load members. Please try again later.');
@@ -61,9 +70,21 @@ const MemberTable = () => {
       }
     };
 
-    fetchMembers();
+    loadFirstPage();
   }, []);
 
+  const handleLoadMore = async () => {
+    setLoadingMore(true);
+    try {
+      await fetchMembers(next);
+    } catch (err) {
+      console.error("Error fetching members:", err);
+      toast.error('Failed to load more members');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleDeleteMember = async (member: Member) => {
     confirmAlert({
       title: 'Confirm Removal',
@@ -212,6 +233,18 @@ const MemberTable = () => {
         </div>
       )}
 
+      {next && (
+        <div className="p-4 text-center border-t border-gray-200">
+          <button
+            onClick={handleLoadMore}
+            disabled={loadingMore}
+            className="text-blue-600 hover:text-blue-900 px-4 py-2 rounded hover:bg-blue-50 disabled:opacity-50"
+          >
+            {loadingMore ? 'Loading...' : 'Load more'}
+          </button>
+        </div>
+      )}
+
       <MemberActionForm 
         isOpen={isMemberActionFormOpen} 
         onClose={handleCloseForm} 
@@ -1,6 +1,6 @@
 import React, { useEffect, useState } from 'react';
 import { useAuth } from '../utils/AuthContext';
-import axios from 'axios';
+import axios, { type AxiosResponse } from 'axios';
 import { useNavigate } from 'react-router-dom';
 import { toast } from 'react-toastify';
 import 'react-toastify/dist/ReactToastify.css';
@@ -45,15 +45,24 @@ const CourseTable = () => {
   const [courses, setCourses] = useState<Outline[]>([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
+  const [next, setNext] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const navigate = useNavigate();
 
+  // The listing comes in pages: the first on mount, the next ones on "Load more"
+  const fetchCourses = async (cursor: string | null = null) => {
+    const response: AxiosResponse = await axios.get(`${import.meta.env.VITE_BACKEND_ADDRESS}/course/course`, {
+      withCredentials: true,
+      params: cursor ? { cursor } : {},
+    });
+    setCourses((loaded) => (cursor ? [...loaded, ...response.data.courses] : response.data.courses));
+    setNext(response.data.next ?? null);
+  };
+
   useEffect(() => {
-    const fetchCourses = async () => {
+    const loadFirstPage = async () => {
       try {
-        const response = await axios.get(`${import.meta.env.VITE_BACKEND_ADDRESS}/course/course`, {
-          withCredentials: true,
-        });
-        setCourses(response.data.courses);
+        await fetchCourses();
       } catch (err) {
         console.error("Error fetching courses:", err);
         setError('Failed to load courses. Please try again later.');
@@ -63,9 +72,21 @@ const CourseTable = () => {
       }
     };
 
-    fetchCourses();
+    loadFirstPage();
   }, []);
 
+  const handleLoadMore = async () => {
+    setLoadingMore(true);
+    try {
+      await fetchCourses(next);
+    } catch (err) {
+      console.error("Error fetching courses:", err);
+      toast.error('Failed to load more courses');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleDelete = async (outline: Outline) => {
     confirmAlert({
       title: 'Confirm Deletion',
@@ -218,6 +239,18 @@ const CourseTable = () => {
           </table>
         </div>
       )}
+
+      {next && (
+        <div className="p-4 text-center border-t border-gray-200">
+          <button
+            onClick={handleLoadMore}
+            disabled={loadingMore}
+            className="text-blue-600 hover:text-blue-900 px-4 py-2 rounded hover:bg-blue-50 disabled:opacity-50"
+          >
+            {loadingMore ? 'Loading...' : 'Load more'}
+          </button>
+        </div>
+      )}
     </div>
   );
 };